@@ -0,0 +1,322 @@
+"""
+Анализаторы кода для CodeValidator.
+
+Валидатор проходит по строкам кода один раз и передает каждую строку анализатору языка.
+Анализаторы регистрируются через register_analyzer и сообщают о замечаниях в виде словарей
+{"severity": "error" | "warning" | "suggestion", "line": номер строки или None, "rule": ..., "message": ...}.
+"""
+import re
+from typing import Dict, Any, List, Optional, Iterator, Tuple, Type
+
+ANALYZERS: Dict[str, Type["LanguageAnalyzer"]] = {}
+
+def register_analyzer(*languages: str):
+    def decorator(cls):
+        for language in languages:
+            ANALYZERS[language] = cls
+        return cls
+    return decorator
+
+def create_analyzer(language: str, code: str) -> "LanguageAnalyzer":
+    analyzer_class = ANALYZERS.get((language or "").strip().lower(), LanguageAnalyzer)
+    return analyzer_class(code)
+
+def iter_lines(code: str) -> Iterator[str]:
+    # То же, что code.split('\n'), но без построения списка всех строк
+    start = 0
+    while True:
+        end = code.find('\n', start)
+        if end == -1:
+            yield code[start:]
+            return
+        yield code[start:end]
+        start = end + 1
+
+# Базовый анализатор: только подсчет комментариев, используется для неизвестных языков
+class LanguageAnalyzer:
+    def __init__(self, code: str):
+        self.code = code
+        self.issues: List[Dict[str, Any]] = []
+        self.comment_lines = 0
+    
+    def report(self, severity: str, message: str, line: Optional[int] = None, rule: Optional[str] = None):
+        self.issues.append({
+            "severity": severity,
+            "line": line,
+            "rule": rule,
+            "message": message
+        })
+    
+    def feed_line(self, number: int, line: str):
+        if '//' in line or '/*' in line:
+            self.comment_lines += 1
+    
+    def finish(self, total_lines: int):
+        pass
+
+@register_analyzer("python", "py")
+class PythonAnalyzer(LanguageAnalyzer):
+    BARE_EXCEPT = re.compile(r'^\s*except\s*:')
+    STAR_IMPORT = re.compile(r'^\s*from\s+\S+\s+import\s+\*')
+    
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.bare_except_line: Optional[int] = None
+        self.star_import_line: Optional[int] = None
+    
+    def feed_line(self, number: int, line: str):
+        stripped = line.lstrip()
+        if stripped.startswith('#'):
+            self.comment_lines += 1
+        elif stripped.startswith('except') and self.bare_except_line is None and self.BARE_EXCEPT.match(line):
+            self.bare_except_line = number
+        elif stripped.startswith('from') and self.star_import_line is None and self.STAR_IMPORT.match(line):
+            self.star_import_line = number
+    
+    def finish(self, total_lines: int):
+        # compile() без построения объектов ast: для проверки синтаксиса это примерно вдвое быстрее ast.parse
+        try:
+            compile(self.code, '<string>', 'exec', dont_inherit=True)
+        except (SyntaxError, ValueError) as e:
+            self.report("error", f"Синтаксическая ошибка Python: {e}", getattr(e, "lineno", None), "syntax")
+        
+        if self.bare_except_line:
+            self.report("warning", f"Голый except перехватывает все исключения (строка {self.bare_except_line})",
+                        self.bare_except_line, "bare-except")
+        if self.star_import_line:
+            self.report("suggestion", f"Избегайте импорта через * (строка {self.star_import_line})",
+                        self.star_import_line, "star-import")
+
+# Токенизатор для языков с синтаксисом в стиле C: отслеживает комментарии, строки и парность скобок.
+# Состояние (многострочный комментарий, многострочная строка, стек скобок) переносится между строками.
+class CLikeAnalyzer(LanguageAnalyzer):
+    # Однострочные строковые литералы
+    string_quotes = ('"', "'")
+    # Многострочные литералы: (открывающая последовательность, закрывающая, способ экранирования)
+    multiline_strings: Tuple[Tuple[str, str, str], ...] = ()
+    # Литералы регулярных выражений /.../ (JavaScript/TypeScript)
+    regex_literals = False
+    # Правила по коду без строк и комментариев: (regex, уровень, правило, сообщение)
+    line_rules: Tuple[Tuple[str, str, str, str], ...] = ()
+    
+    BRACKETS = {')': '(', ']': '[', '}': '{'}
+    REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+    
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.mode: Optional[str] = None
+        self.string_end = ""
+        self.string_escape = ""
+        self.string_start_line = 0
+        self.comment_start_line = 0
+        self.stack: List[Tuple[str, int]] = []
+        self.brackets_broken = False
+        self.last_significant = ""
+        self.rule_hits: Dict[str, List[int]] = {}
+        
+        special = {'/', '(', ')', '[', ']', '{', '}'} | set(self.string_quotes)
+        special |= {opener[0] for opener, _, _ in self.multiline_strings}
+        self._special = re.compile('[' + re.escape(''.join(sorted(special))) + ']')
+        self._openers = sorted(self.multiline_strings, key=lambda item: -len(item[0]))
+        self._rules = [(re.compile(pattern), severity, rule, message) for pattern, severity, rule, message in self.line_rules]
+    
+    @staticmethod
+    def _find_string_end(line: str, start: int, closer: str, escape: str) -> int:
+        i = start
+        while True:
+            j = line.find(closer, i)
+            if j == -1:
+                return -1
+            if escape == "backslash":
+                backslashes = 0
+                k = j - 1
+                while k >= start and line[k] == '\\':
+                    backslashes += 1
+                    k -= 1
+                if backslashes % 2:
+                    i = j + 1
+                    continue
+            elif escape == "double" and line.startswith(closer + closer, j):
+                i = j + 2 * len(closer)
+                continue
+            return j
+    
+    @staticmethod
+    def _find_regex_end(line: str, start: int) -> int:
+        in_class = False
+        i = start
+        while i < len(line):
+            ch = line[i]
+            if ch == '\\':
+                i += 2
+                continue
+            if ch == '[':
+                in_class = True
+            elif ch == ']':
+                in_class = False
+            elif ch == '/' and not in_class:
+                return i
+            i += 1
+        return -1
+    
+    def _bracket(self, ch: str, number: int):
+        if self.brackets_broken:
+            return
+        if ch in '([{':
+            self.stack.append((ch, number))
+            return
+        if not self.stack or self.stack[-1][0] != self.BRACKETS[ch]:
+            # После первой непарной скобки дальнейший подсчет ненадежен
+            self.report("error", f"Непарная скобка '{ch}' (строка {number})", number, "brackets")
+            self.brackets_broken = True
+            return
+        self.stack.pop()
+    
+    def feed_line(self, number: int, line: str):
+        i = 0
+        n = len(line)
+        has_comment = False
+        code_parts = []
+        
+        while i < n:
+            if self.mode == "comment":
+                has_comment = True
+                end = line.find('*/', i)
+                if end == -1:
+                    i = n
+                    break
+                i = end + 2
+                self.mode = None
+                continue
+            
+            if self.mode == "string":
+                end = self._find_string_end(line, i, self.string_end, self.string_escape)
+                if end == -1:
+                    i = n
+                    break
+                i = end + len(self.string_end)
+                self.mode = None
+                self.last_significant = '"'
+                continue
+            
+            # Пропускаем обычный код до ближайшего значимого символа
+            match = self._special.search(line, i)
+            m = match.start() if match else n
+            if m > i:
+                chunk = line[i:m]
+                code_parts.append(chunk)
+                stripped = chunk.rstrip()
+                if stripped:
+                    self.last_significant = stripped[-1]
+                i = m
+                if i >= n:
+                    break
+            
+            ch = line[i]
+            
+            if line.startswith('//', i):
+                has_comment = True
+                break
+            if line.startswith('/*', i):
+                has_comment = True
+                self.mode = "comment"
+                self.comment_start_line = number
+                i += 2
+                continue
+            
+            opener = next((item for item in self._openers if line.startswith(item[0], i)), None)
+            if opener:
+                self.mode = "string"
+                _, self.string_end, self.string_escape = opener
+                self.string_start_line = number
+                i += len(opener[0])
+                continue
+            
+            if ch in self.string_quotes:
+                end = self._find_string_end(line, i + 1, ch, "backslash")
+                # Незакрытая однострочная строка заканчивается вместе со строкой кода
+                i = n if end == -1 else end + 1
+                code_parts.append('""')
+                self.last_significant = '"'
+                continue
+            
+            if ch == '/' and self.regex_literals and (not self.last_significant or self.last_significant in self.REGEX_PRECEDERS):
+                end = self._find_regex_end(line, i + 1)
+                if end != -1:
+                    i = end + 1
+                    code_parts.append('/./')
+                    self.last_significant = '/'
+                    continue
+            
+            if ch in '()[]{}':
+                self._bracket(ch, number)
+            code_parts.append(ch)
+            self.last_significant = ch
+            i += 1
+        
+        if has_comment:
+            self.comment_lines += 1
+        
+        if self._rules and code_parts:
+            code = ''.join(code_parts)
+            for pattern, _, rule, _ in self._rules:
+                if pattern.search(code):
+                    self.rule_hits.setdefault(rule, []).append(number)
+    
+    def finish(self, total_lines: int):
+        if self.mode == "comment":
+            self.report("error", f"Незакрытый многострочный комментарий (строка {self.comment_start_line})",
+                        self.comment_start_line, "unterminated-comment")
+        elif self.mode == "string":
+            self.report("error", f"Незакрытый строковый литерал (строка {self.string_start_line})",
+                        self.string_start_line, "unterminated-string")
+        elif self.stack and not self.brackets_broken:
+            bracket, line = self.stack[-1]
+            self.report("error", f"Незакрытая скобка '{bracket}' (строка {line})", line, "brackets")
+        
+        for _, severity, rule, message in self._rules:
+            lines = self.rule_hits.get(rule)
+            if lines:
+                self.report(severity, f"{message} (строк: {len(lines)}, первая: {lines[0]})", lines[0], rule)
+
+@register_analyzer("javascript", "js")
+class JavaScriptAnalyzer(CLikeAnalyzer):
+    multiline_strings = (('`', '`', "backslash"),)
+    regex_literals = True
+    line_rules = (
+        (r'\bvar\b', "suggestion", "no-var", "Используйте let/const вместо var"),
+        (r'(?<![=!<>])==(?!=)', "suggestion", "eqeqeq", "Используйте === вместо =="),
+    )
+
+@register_analyzer("typescript", "ts")
+class TypeScriptAnalyzer(JavaScriptAnalyzer):
+    line_rules = JavaScriptAnalyzer.line_rules + (
+        (r':\s*any\b', "suggestion", "no-any", "Избегайте типа any"),
+    )
+
+@register_analyzer("java")
+class JavaAnalyzer(CLikeAnalyzer):
+    multiline_strings = (('"""', '"""', "backslash"),)
+    line_rules = (
+        (r'System\.(out|err)\.print', "suggestion", "no-system-out", "Используйте логгер вместо System.out"),
+        (r'catch\s*\(\s*(Exception|Throwable)\b', "warning", "broad-catch", "Перехват слишком общего исключения"),
+    )
+
+@register_analyzer("c#", "csharp", "cs")
+class CSharpAnalyzer(CLikeAnalyzer):
+    multiline_strings = (
+        ('"""', '"""', "none"),
+        ('$@"', '"', "double"),
+        ('@$"', '"', "double"),
+        ('@"', '"', "double"),
+    )
+    line_rules = (
+        (r'catch\s*(\{|\(\s*(System\.)?Exception\b)', "warning", "broad-catch", "Перехват слишком общего исключения"),
+    )
+
+@register_analyzer("go", "golang")
+class GoAnalyzer(CLikeAnalyzer):
+    multiline_strings = (('`', '`', "none"),)
+    line_rules = (
+        (r'\bpanic\(', "suggestion", "no-panic", "Возвращайте error вместо panic"),
+    )
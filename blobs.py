@@ -0,0 +1,90 @@
+"""
+Хранилище тел кода с адресацией по содержимому.
+
+Код шаблонов и генераций лежит в таблице code_blobs, по одной строке на каждый уникальный текст (ключ - SHA-256).
+Template и GeneratedCode хранят только code_hash, а атрибуты Template.code и GeneratedCode.generated_code
+читают текст подзапросом к code_blobs (см. модели в database.py).
+
+Запись прозрачна для остального кода: перед flush новый текст кладется в code_blobs (или увеличивает
+счетчик ссылок существующей строки), а старый hash освобождается. Строки, на которые больше никто
+не ссылается, удаляются после flush в той же транзакции.
+"""
+import hashlib
+from typing import Optional
+from sqlalchemy import event, inspect, update, delete
+from sqlalchemy.orm import Session
+from database import CodeBlob, Template, GeneratedCode
+
+# Модель -> атрибут с телом кода
+CODE_ATTRIBUTES = {Template: "code", GeneratedCode: "generated_code"}
+
+def content_hash(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def upsert_statement(dialect_name: str, values: dict):
+    table = CodeBlob.__table__
+    if dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        return insert(table).values(**values).on_duplicate_key_update(ref_count=table.c.ref_count + 1)
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).values(**values).on_conflict_do_update(
+        index_elements=[table.c.hash], set_={"ref_count": table.c.ref_count + 1}
+    )
+
+def acquire_blob(connection, body: str) -> str:
+    # Одна вставка или увеличение счетчика, без предварительного SELECT
+    body_hash = content_hash(body)
+    connection.execute(upsert_statement(connection.dialect.name, {
+        "hash": body_hash,
+        "body": body,
+        "size": len(body.encode("utf-8")),
+        "ref_count": 1
+    }))
+    return body_hash
+
+def release_blob(connection, body_hash: Optional[str]):
+    if body_hash:
+        connection.execute(
+            update(CodeBlob.__table__).where(CodeBlob.hash == body_hash).values(ref_count=CodeBlob.ref_count - 1)
+        )
+
+@event.listens_for(Session, "before_flush")
+def store_code_blobs(session, flush_context, instances):
+    connection = None
+    released = session.info.setdefault("released_blobs", set())
+    
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        attribute = CODE_ATTRIBUTES.get(type(obj))
+        if attribute is None:
+            continue
+        if connection is None:
+            connection = session.connection()
+        
+        if obj in session.deleted:
+            if obj.code_hash:
+                release_blob(connection, obj.code_hash)
+                released.add(obj.code_hash)
+            continue
+        
+        history = inspect(obj).attrs[attribute].history
+        if not history.added:
+            continue
+        body = history.added[0]
+        old_hash = obj.code_hash
+        obj.code_hash = acquire_blob(connection, body) if body is not None else None
+        # Сначала новая ссылка, потом освобождение старой: при неизменном тексте строка не удаляется
+        if old_hash:
+            release_blob(connection, old_hash)
+            released.add(old_hash)
+
+@event.listens_for(Session, "after_flush")
+def delete_unused_code_blobs(session, flush_context):
+    # После UPDATE/DELETE строк: триггеры полнотекстового индекса еще читали старый текст
+    released = session.info.pop("released_blobs", None)
+    if released:
+        session.connection().execute(
+            delete(CodeBlob.__table__).where(CodeBlob.hash.in_(released), CodeBlob.ref_count <= 0)
+        )
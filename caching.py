@@ -0,0 +1,88 @@
+"""
+Условные запросы для читающих API.
+
+Маршрут сначала получает дешевые валидаторы (updated_at строки или count и max(updated_at) выборки),
+строит по ним ETag и Last-Modified и только если клиент прислал устаревшие If-None-Match / If-Modified-Since,
+загружает и сериализует данные. Иначе ответ - 304 без тела.
+
+ETag слабые (W/"..."): они описывают данные, а не конкретные байты ответа, поэтому остаются верными
+и после сжатия ответа. Cache-Control задается для каждого маршрута своей настройкой.
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+
+def private_cache_control(value: str) -> str:
+    # Ответы конкретного пользователя: public из настройки заменяется на private, чтобы общие кеши их не хранили
+    directives = [item.strip() for item in value.split(",") if item.strip().lower() not in ("", "public", "private")]
+    return ", ".join(["private"] + directives)
+
+# Список шаблонов меняется редко: минуту отдается из кеша без запроса к серверу
+CACHE_CONTROL_TEMPLATES = os.getenv("CACHE_CONTROL_TEMPLATES", "public, max-age=60")
+CACHE_CONTROL_PROJECTS = os.getenv("CACHE_CONTROL_PROJECTS", "public, no-cache")
+CACHE_CONTROL_STATS = os.getenv("CACHE_CONTROL_STATS", "public, max-age=30")
+# Генерация видна только владельцу: прокси ее не кешируют, браузер каждый раз перепроверяет
+CACHE_CONTROL_GENERATION = private_cache_control(os.getenv("CACHE_CONTROL_GENERATION", "private, no-cache"))
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    # Слабое сравнение (RFC 9110): W/"x" совпадает с "x"
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in header.split(","))
+
+def http_date(value: datetime) -> str:
+    # Время в базе хранится без зоны, в локальном времени сервера (datetime.now)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def modified_since(header: Optional[str], last_modified: datetime) -> bool:
+    if not header:
+        return True
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP-дата с точностью до секунды
+    return last_modified.astimezone(timezone.utc).replace(microsecond=0) > since
+
+def conditional_response(
+    request: Request,
+    response: Response,
+    etag: str,
+    last_modified: Optional[datetime],
+    cache_control: str
+) -> Optional[Response]:
+    # Записывает валидаторы в ответ маршрута; если копия клиента актуальна, возвращает готовый 304
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match важнее If-Modified-Since
+        fresh = etag_matches(if_none_match, etag)
+    else:
+        fresh = last_modified is not None and not modified_since(request.headers.get("if-modified-since"), last_modified)
+    
+    if fresh:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+def collection_validators(query: Query, model) -> Tuple[int, Optional[datetime]]:
+    # Число строк ловит удаление, max(updated_at) - добавление и изменение.
+    # Удаление заметно только по ETag: Last-Modified выборки после него не меняется.
+    return query.order_by(None).with_entities(func.count(model.id), func.max(model.updated_at)).one()
@@ -0,0 +1,60 @@
+"""
+Сжатое хранение больших текстовых колонок (код шаблонов и сгенерированный код).
+
+Значение длиннее COMPRESSION_MIN_BYTES записывается в SQLite как BLOB: байт-маркер и данные zlib.
+Короткие значения и старые несжатые строки остаются текстом, поэтому при чтении тип значения
+(str или bytes) и маркер однозначно показывают, нужно ли распаковывать.
+
+В других СУБД колонка работает как обычный Text: PostgreSQL сам сжимает большие значения (TOAST),
+а бинарные данные в текстовой колонке там недопустимы.
+
+Триггеры полнотекстового индекса читают код через SQL-функцию decompress_text,
+которую register_sqlite_functions добавляет в каждое соединение SQLite.
+Строки, записанные до появления сжатия, сжимает фоновая задача CompressionBackfill (jobs.py).
+"""
+import os
+import zlib
+from typing import Optional, Union
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "512"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+
+ZLIB_MARKER = b"\x01"
+
+def compress_text(value: str, min_bytes: int = COMPRESSION_MIN_BYTES, level: int = COMPRESSION_LEVEL) -> Union[str, bytes]:
+    data = value.encode("utf-8")
+    if len(data) < min_bytes:
+        return value
+    compressed = ZLIB_MARKER + zlib.compress(data, level)
+    # Несжимаемые данные хранить в сжатом виде невыгодно
+    return compressed if len(compressed) < len(data) else value
+
+def decompress_text(value: Union[str, bytes, memoryview, None]) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    if data[:1] == ZLIB_MARKER:
+        return zlib.decompress(data[1:]).decode("utf-8")
+    return data.decode("utf-8")
+
+class CompressedText(TypeDecorator):
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return compress_text(value)
+    
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+def recompress_text(value: Union[str, bytes, memoryview, None]) -> Union[str, bytes, None]:
+    return None if value is None else compress_text(decompress_text(value))
+
+def register_sqlite_functions(dbapi_connection):
+    dbapi_connection.create_function("decompress_text", 1, decompress_text, deterministic=True)
+    # Для фонового сжатия: значение пересчитывается в том же UPDATE, без чтения строки в Python
+    dbapi_connection.create_function("compress_text", 1, recompress_text, deterministic=True)
@@ -1,19 +1,143 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float, inspect, text
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy import create_engine, event, select, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float, Index
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, column_property
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from dotenv import load_dotenv
 from datetime import datetime
-import hashlib
-import secrets
+from typing import Dict, Any
+import asyncio
 import json
 import os
+from passwords import password_hasher
+from compression import CompressedText, register_sqlite_functions
+
+load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./codegen.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./codegen.db")
+# URL для асинхронного движка; по умолчанию тот же DATABASE_URL с асинхронным драйвером
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() == "true"
+
+# Пул соединений
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+
+# Профиль SQLite: "production" (WAL и настройки ниже) или "default" (настройки SQLite по умолчанию)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+def sqlite_production_pragmas():
+    # WAL позволяет читать во время записи, а с synchronous=NORMAL коммит не ждет fsync на каждую транзакцию.
+    # busy_timeout заставляет писателей ждать освобождения блокировки вместо немедленного "database is locked".
+    return [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+# Асинхронные драйверы для бэкендов, у которых DATABASE_URL задан с синхронным драйвером
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+def is_memory_database(database_url: URL) -> bool:
+    return database_url.get_backend_name() == "sqlite" and database_url.database in (None, "", ":memory:")
+
+def shared_database_url(url: str) -> URL:
+    database_url = make_url(url)
+    if is_memory_database(database_url):
+        # Синхронный и асинхронный движки должны видеть одну и ту же базу в памяти
+        database_url = database_url.set(database="file:codegen?mode=memory&cache=shared", query={"uri": "true"})
+    return database_url
+
+def make_async_url(url: str) -> URL:
+    database_url = shared_database_url(url)
+    backend = database_url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Нет асинхронного драйвера для {backend}, задайте ASYNC_DATABASE_URL")
+    return database_url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def engine_options(database_url: URL, memory: bool) -> Dict[str, Any]:
+    options: Dict[str, Any] = {"echo": DATABASE_ECHO}
+    
+    if database_url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+            pool_recycle=DATABASE_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+        return options
+    
+    options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    if memory:
+        # База в памяти существует, пока открыто соединение, поэтому оно одно на весь движок
+        options["poolclass"] = StaticPool
+    else:
+        options.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT
+        )
+    return options
+
+def apply_sqlite_profile(sync_engine):
+    if sync_engine.dialect.name != "sqlite" or SQLITE_PROFILE != "production":
+        return
+    
+    pragmas = sqlite_production_pragmas()
+    
+    @event.listens_for(sync_engine, "connect")
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+def apply_sqlite_functions(sync_engine):
+    # Функции для сжатых колонок нужны в каждом соединении: их вызывают триггеры полнотекстового индекса
+    if sync_engine.dialect.name != "sqlite":
+        return
+    
+    @event.listens_for(sync_engine, "connect")
+    def register_functions(dbapi_connection, connection_record):
+        register_sqlite_functions(dbapi_connection)
+
+def create_database_engine(url: str = SQLALCHEMY_DATABASE_URL):
+    database_url = shared_database_url(url)
+    new_engine = create_engine(database_url, **engine_options(database_url, is_memory_database(make_url(url))))
+    apply_sqlite_profile(new_engine)
+    apply_sqlite_functions(new_engine)
+    return new_engine
+
+def create_async_database_engine(url: str = SQLALCHEMY_DATABASE_URL, async_url: str = ASYNC_DATABASE_URL):
+    database_url = make_url(async_url) if async_url else make_async_url(url)
+    new_engine = create_async_engine(database_url, **engine_options(database_url, is_memory_database(make_url(url))))
+    apply_sqlite_profile(new_engine.sync_engine)
+    apply_sqlite_functions(new_engine.sync_engine)
+    return new_engine
+
+# Синхронный движок: создание таблиц, демо-данные и прочая работа при старте
+engine = create_database_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Асинхронный движок: обработчики запросов и фоновые задачи, не блокирующие event loop
+async_engine = create_async_database_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # Функция для получения сессии БД
@@ -24,6 +148,25 @@ def get_db():
     finally:
         db.close()
 
+# Асинхронная сессия БД для обработчиков запросов
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def run_in_session(db, fn, *args, **kwargs):
+    # Вызывает синхронную функцию вида fn(session, ...) с обычной или асинхронной сессией.
+    # Для AsyncSession функция выполняется через run_sync: запросы идут через асинхронный драйвер
+    # и не блокируют event loop. Одну AsyncSession нельзя использовать из нескольких задач
+    # одновременно, поэтому вызовы на одной сессии выполняются по очереди.
+    if not isinstance(db, AsyncSession):
+        return fn(db, *args, **kwargs)
+    
+    lock = db.info.get("run_lock")
+    if lock is None:
+        lock = db.info["run_lock"] = asyncio.Lock()
+    async with lock:
+        return await db.run_sync(fn, *args, **kwargs)
+
 # Модели
 class User(Base):
     __tablename__ = "users"
@@ -43,22 +186,12 @@ class User(Base):
     projects = relationship("Project", back_populates="owner")
     generated_codes = relationship("GeneratedCode", back_populates="user")
     
+    # Синхронные варианты; в асинхронном коде используйте password_hasher.hash_async / verify_async
     def set_password(self, password: str):
-        if len(password) > 50:
-            password = password[:50]
-        salt = secrets.token_hex(8)
-        self.hashed_password = f"{salt}:{hashlib.sha256((password + salt).encode()).hexdigest()}"
+        self.hashed_password = password_hasher.hash(password)
     
     def check_password(self, password: str) -> bool:
-        if not self.hashed_password:
-            return False
-        try:
-            salt, stored_hash = self.hashed_password.split(':')
-            if len(password) > 50:
-                password = password[:50]
-            return hashlib.sha256((password + salt).encode()).hexdigest() == stored_hash
-        except:
-            return False
+        return password_hasher.verify(password, self.hashed_password)
 
 class Project(Base):
     __tablename__ = "projects"
@@ -77,6 +210,27 @@ class Project(Base):
     
     owner = relationship("User", back_populates="projects")
     generated_codes = relationship("GeneratedCode", back_populates="project")
+    
+    __table_args__ = (
+        Index("ix_projects_created", "created_at", "id"),
+    )
+
+# Тела кода шаблонов и генераций: одна строка на уникальный текст, со счетчиком ссылок (см. blobs.py)
+class CodeBlob(Base):
+    __tablename__ = "code_blobs"
+    
+    id = Column(Integer, primary_key=True)
+    hash = Column(String(64), unique=True, index=True, nullable=False)
+    body = Column(CompressedText, nullable=False)
+    size = Column(Integer, default=0, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+def code_body(hash_column):
+    # Текст по hash; атрибут можно присваивать - новое значение сохраняет blobs.py перед flush
+    return column_property(
+        select(CodeBlob.body).where(CodeBlob.hash == hash_column).correlate_except(CodeBlob).scalar_subquery()
+    )
 
 class Template(Base):
     __tablename__ = "templates"
@@ -87,22 +241,30 @@ class Template(Base):
     language = Column(String(50), nullable=False)
     category = Column(String(100))
     framework = Column(String(100))
-    code = Column(Text, nullable=False)
+    code_hash = Column(String(64))
+    code = code_body(code_hash)
     downloads = Column(Integer, default=0)
     rating = Column(Float, default=0.0)
     tags = Column(Text)
     is_public = Column(Boolean, default=True)
     creator_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
     creator = relationship("User")
+    
+    __table_args__ = (
+        Index("ix_templates_public_filters", "is_public", "language", "category", "framework"),
+        Index("ix_templates_public_created", "is_public", "created_at", "id"),
+    )
 
 class GeneratedCode(Base):
     __tablename__ = "generated_codes"
     
     id = Column(Integer, primary_key=True, index=True)
     requirements = Column(Text, nullable=False)
-    generated_code = Column(Text, nullable=False)
+    code_hash = Column(String(64))
+    generated_code = code_body(code_hash)
     language = Column(String(50), nullable=False)
     framework = Column(String(100))
     lines_of_code = Column(Integer, default=0)
@@ -112,35 +274,79 @@ class GeneratedCode(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     project_id = Column(Integer, ForeignKey("projects.id"))
     template_id = Column(Integer, ForeignKey("templates.id"))
+    # Флаг use_cache задачи очереди (jobs.py); None - строка создана не очередью
+    job_use_cache = Column(Boolean)
     created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
     user = relationship("User", back_populates="generated_codes")
     project = relationship("Project", back_populates="generated_codes")
     template = relationship("Template")
+    
+    __table_args__ = (
+        Index("ix_generated_codes_user_created", "user_id", "created_at", "id"),
+    )
+
+class GenerationCache(Base):
+    __tablename__ = "generation_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False)
+    generated_code = Column(Text, nullable=False)
+    language = Column(String(50), nullable=False)
+    framework = Column(String(100))
+    lines_of_code = Column(Integer, default=0)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, index=True)
+
+class ValidationCache(Base):
+    __tablename__ = "validation_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False)
+    validator_version = Column(Integer, nullable=False)
+    result = Column(Text, nullable=False)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, index=True)
+
+# Счетчики для /api/stats, поддерживаются инкрементально (см. stats.py)
+class SystemCounters(Base):
+    __tablename__ = "system_counters"
+    
+    id = Column(Integer, primary_key=True)
+    total_projects = Column(Integer, default=0, nullable=False)
+    completed_projects = Column(Integer, default=0, nullable=False)
+    active_projects = Column(Integer, default=0, nullable=False)
+    total_lines_of_code = Column(Integer, default=0, nullable=False)
+    total_templates = Column(Integer, default=0, nullable=False)
+    total_users = Column(Integer, default=0, nullable=False)
+    total_generations = Column(Integer, default=0, nullable=False)
+    total_generated_lines = Column(Integer, default=0, nullable=False)
+    rebuilt_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
-def check_and_add_columns():
-    inspector = inspect(engine)
-    if 'users' in inspector.get_table_names():
-        columns = [col['name'] for col in inspector.get_columns('users')]
-        
-        if 'hashed_password' not in columns:
-            print("Добавляем столбец hashed_password в таблицу users...")
-            with engine.connect() as conn:
-                conn.execute(text('ALTER TABLE users ADD COLUMN hashed_password VARCHAR(255)'))
-                conn.commit()
-        
-        if 'bio' not in columns:
-            print("Добавляем столбец bio в таблицу users...")
-            with engine.connect() as conn:
-                conn.execute(text('ALTER TABLE users ADD COLUMN bio TEXT'))
-                conn.commit()
+# Счетчики генераций пользователя для главной страницы и профиля
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_generations = Column(Integer, default=0, nullable=False)
+    total_lines = Column(Integer, default=0, nullable=False)
+
+# Выполненные миграции схемы (см. migrations.py)
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)
+    description = Column(String(200), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now)
 
 def init_demo_data():
     from sqlalchemy.orm import Session
     import json
     
-    check_and_add_columns()
-    
     db = SessionLocal()
     try:   
         if db.query(Template).count() == 0:
@@ -1,23 +1,73 @@
-from typing import Optional
+from typing import Optional, List, Tuple, Dict, Any
+from collections import OrderedDict
 import jwt
-from fastapi import Depends, Request, HTTPException, Cookie
+from fastapi import Depends, Request, HTTPException
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import select, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from database import GeneratedCode
-from database import get_db, User, SECRET_KEY, ALGORITHM
-from services import auth_service
-from services import validator
+from database import get_async_db, AsyncSessionLocal, User, SECRET_KEY, ALGORITHM
+from services import validation_executor
 import json
+import asyncio
+import time
+import os
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "1024"))
 
 templates = Jinja2Templates(directory="templates")
 
-async def get_current_user(
-    db: Session = Depends(get_db),
-    access_token: Optional[str] = Cookie(None)
-):
+# Кэш пользователей по токену на уровне процесса.
+# Хранятся значения колонок, а не объект ORM: объект принадлежит сессии запроса,
+# поэтому при попадании он собирается заново и присоединяется к новой сессии без запроса к базе.
+class UserTokenCache:
+    def __init__(self, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+    
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        expires_at, values = entry
+        if expires_at <= time.time():
+            del self.entries[token]
+            return None
+        return values
+    
+    def put(self, token: str, user: User, token_expires_at: Optional[float] = None):
+        if self.ttl_seconds <= 0:
+            return
+        # Запись не переживает сам токен
+        expires_at = time.time() + self.ttl_seconds
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        values = {column.key: getattr(user, column.key) for column in inspect(User).column_attrs}
+        self.entries[token] = (expires_at, values)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def invalidate_user(self, user_id: int):
+        for token in [token for token, (_, values) in self.entries.items() if values["id"] == user_id]:
+            del self.entries[token]
+
+user_token_cache = UserTokenCache()
+
+async def load_user_by_token(access_token: Optional[str], db: AsyncSession) -> Optional[User]:
     if not access_token:
         return None
     
+    values = user_token_cache.get(access_token)
+    if values is not None:
+        # merge с load=False присоединяет объект к сессии как загруженный, без SELECT
+        user = User(**values)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+    
     try:
         payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -26,9 +76,20 @@ async def get_current_user(
     except jwt.PyJWTError:
         return None
     
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
+    if user:
+        user_token_cache.put(access_token, user, payload.get("exp"))
     return user
 
+async def resolve_user(request: Request, db: AsyncSession) -> Optional[User]:
+    # Пользователь определяется один раз за запрос, сколько бы зависимостей и обработчиков его ни запрашивали
+    if not hasattr(request.state, "current_user"):
+        request.state.current_user = await load_user_by_token(request.cookies.get("access_token"), db)
+    return request.state.current_user
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await resolve_user(request, db)
+
 async def get_current_user_dependency(
     current_user: Optional[User] = Depends(get_current_user)
 ):
@@ -40,32 +101,43 @@ async def get_current_user_dependency(
         )
     return current_user
 
-async def get_user_context(request: Request, db: Session = Depends(get_db)):
-    access_token = request.cookies.get("access_token")
-    user = None
-    
-    if access_token:
+async def get_user_context(request: Request, db: AsyncSession = Depends(get_async_db)):
+    return {"user": await resolve_user(request, db)}
+
+def apply_validation_result(generated_code: GeneratedCode, result: dict):
+    generated_code.status = "validated" if result["is_valid"] else "error"
+    generated_code.validation_errors = json.dumps(result["errors"]) if result["errors"] else None
+    generated_code.optimization_suggestions = json.dumps(result["suggestions"]) if result["suggestions"] else None
+
+async def validate_code_background(code_id: int, code: str, language: str): 
+    # Отдельная сессия: сессия запроса к моменту запуска фоновой задачи уже закрыта
+    async with AsyncSessionLocal() as db:
         try:
-            payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username:
-                user = db.query(User).filter(User.username == username).first()
-        except jwt.PyJWTError:
-            pass
-    
-    return {"user": user}
+            result = await validation_executor.validate(code, language, db=db)
+            
+            generated_code = await db.get(GeneratedCode, code_id)
+            if generated_code:
+                apply_validation_result(generated_code, result)
+                
+                await db.commit()
+        except Exception as e:
+            print(f"Ошибка при фоновой валидации: {e}")
 
-async def validate_code_background(db: Session, code_id: int, code: str, language: str): 
-    try:
-        result = validator.validate(code, language)
-        
-        
-        generated_code = db.query(GeneratedCode).filter(GeneratedCode.id == code_id).first()
-        if generated_code:
-            generated_code.status = "validated" if result["is_valid"] else "error"
-            generated_code.validation_errors = json.dumps(result["errors"]) if result["errors"] else None
-            generated_code.optimization_suggestions = json.dumps(result["suggestions"]) if result["suggestions"] else None
+async def validate_codes_background(items: List[Tuple[int, str, str]]):
+    # Валидирует пакет генераций и сохраняет все результаты одним коммитом
+    async with AsyncSessionLocal() as db:
+        try:
+            validation_results = await asyncio.gather(*(
+                validation_executor.validate(code, language, db=db) for _, code, language in items
+            ))
+            results = {code_id: result for (code_id, _, _), result in zip(items, validation_results)}
+            
+            generated_codes = (await db.scalars(
+                select(GeneratedCode).where(GeneratedCode.id.in_(list(results)))
+            )).all()
+            for generated_code in generated_codes:
+                apply_validation_result(generated_code, results[generated_code.id])
             
-            db.commit()
-    except Exception as e:
-        print(f"Ошибка при фоновой валидации: {e}")
\ No newline at end of file
+            await db.commit()
+        except Exception as e:
+            print(f"Ошибка при фоновой валидации пакета: {e}")
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Скачивание кода шаблонов и генераций как обычных файлов.
+
+Ответ содержит сами байты кода (без JSON-обертки), имя файла с расширением языка в Content-Disposition
+и сильный ETag - это SHA-256 текста, который уже хранится в code_hash. Поэтому If-None-Match
+проверяется без чтения тела из code_blobs, а повторная загрузка кода отдает 304.
+Заголовок Range (один диапазон байт) позволяет докачивать большие файлы.
+"""
+import re
+from typing import Optional, Tuple
+from urllib.parse import quote
+from fastapi import Request, Response, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import CodeBlob
+from blobs import content_hash
+from caching import etag_matches
+
+FILE_EXTENSIONS = {
+    "typescript": "ts", "javascript": "js", "python": "py", "java": "java",
+    "c#": "cs", "csharp": "cs", "go": "go", "golang": "go", "html": "html", "css": "css",
+}
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def file_extension(language: Optional[str]) -> str:
+    return FILE_EXTENSIONS.get((language or "").strip().lower(), "txt")
+
+def file_slug(title: Optional[str], default: str = "code") -> str:
+    return re.sub(r'\W+', '-', (title or "").lower()).strip('-')[:40].strip('-') or default
+
+def content_disposition(file_name: str) -> str:
+    # filename - ASCII-запасной вариант для старых клиентов, filename* - настоящее имя в UTF-8
+    fallback = file_name.encode("ascii", "replace").decode().replace("?", "_").replace('"', "_")
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(file_name)}'
+
+def code_etag(body_hash: Optional[str]) -> str:
+    return f'"{body_hash or content_hash("")}"'
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # Возвращает (первый, последний) байт включительно или None, если отдавать файл целиком.
+    # Несколько диапазонов и синтаксически неверный заголовок игнорируются, как разрешает RFC 9110.
+    match = RANGE_PATTERN.match((header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    
+    if not first:
+        # bytes=-N: последние N байт
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise range_not_satisfiable(size)
+        return max(size - suffix, 0), size - 1
+    
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise range_not_satisfiable(size)
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+def range_not_satisfiable(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=416,
+        detail="Запрошенный диапазон за пределами файла",
+        headers={"Content-Range": f"bytes */{size}"}
+    )
+
+async def load_code_body(db: AsyncSession, body_hash: Optional[str]) -> str:
+    if not body_hash:
+        return ""
+    return await db.scalar(select(CodeBlob.body).where(CodeBlob.hash == body_hash)) or ""
+
+async def code_file_response(
+    request: Request,
+    db: AsyncSession,
+    body_hash: Optional[str],
+    file_name: str,
+    cache_control: str
+) -> Response:
+    etag = code_etag(body_hash)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    data = (await load_code_body(db, body_hash)).encode("utf-8")
+    headers["Content-Disposition"] = content_disposition(file_name)
+    headers["X-Content-Type-Options"] = "nosniff"
+    
+    # If-Range: диапазон действует, только если у клиента та же версия файла (сильное сравнение)
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if if_range is None or if_range.strip() == etag:
+        byte_range = parse_range(request.headers.get("range"), len(data))
+    
+    if byte_range is None:
+        return Response(content=data, media_type="text/plain; charset=utf-8", headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(
+        content=data[start:end + 1],
+        status_code=206,
+        media_type="text/plain; charset=utf-8",
+        headers=headers
+    )
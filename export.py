@@ -0,0 +1,133 @@
+"""
+Экспорт истории генераций пользователя одним ZIP-архивом.
+
+Архив собирается на лету: строки читаются из базы пачками (yield_per), каждый файл сжимается
+и сразу отдается клиенту, поэтому в памяти не держится ни весь архив, ни вся выборка.
+Последним в архив пишется manifest.json с описанием каждой генерации.
+"""
+import os
+import re
+import json
+import zipfile
+from datetime import datetime, time, timedelta
+from typing import AsyncIterator, Dict, Any
+from sqlalchemy import select
+from database import AsyncSessionLocal, GeneratedCode
+from downloads import file_extension, file_slug
+
+# Сколько строк читается из базы за один запрос к курсору
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "100"))
+EXPORT_COMPRESSION_LEVEL = int(os.getenv("EXPORT_COMPRESSION_LEVEL", "6"))
+
+MANIFEST_COLUMNS = (
+    GeneratedCode.id, GeneratedCode.requirements, GeneratedCode.language, GeneratedCode.framework,
+    GeneratedCode.status, GeneratedCode.lines_of_code, GeneratedCode.project_id,
+    GeneratedCode.template_id, GeneratedCode.created_at, GeneratedCode.code_hash
+)
+
+# Файловый объект только для записи: zipfile пишет в него, генератор забирает накопленные байты.
+# Без seek/tell zipfile сам переходит в потоковый режим с дескрипторами данных после каждого файла.
+class ZipStream:
+    def __init__(self):
+        self.buffer = bytearray()
+    
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def generation_file_name(row) -> str:
+    language = (row.language or "text").strip().lower()
+    folder = re.sub(r'[^\w#+.-]', '_', language)
+    return f"{folder}/{row.id}-{file_slug(row.requirements)}.{file_extension(language)}"
+
+class GenerationExportService:
+    def __init__(self, chunk_rows: int = EXPORT_CHUNK_ROWS, compression_level: int = EXPORT_COMPRESSION_LEVEL):
+        self.chunk_rows = chunk_rows
+        self.compression_level = compression_level
+    
+    @staticmethod
+    def filtered(statement, user_id: int, filters: Dict[str, Any]):
+        statement = statement.where(GeneratedCode.user_id == user_id)
+        if filters.get("language"):
+            statement = statement.where(GeneratedCode.language == filters["language"])
+        if filters.get("project_id") is not None:
+            statement = statement.where(GeneratedCode.project_id == filters["project_id"])
+        if filters.get("date_from"):
+            statement = statement.where(GeneratedCode.created_at >= datetime.combine(filters["date_from"], time.min))
+        if filters.get("date_to"):
+            # Дата окончания включается целиком
+            statement = statement.where(GeneratedCode.created_at < datetime.combine(filters["date_to"] + timedelta(days=1), time.min))
+        return statement.order_by(GeneratedCode.created_at, GeneratedCode.id)
+    
+    async def stream_archive(self, user_id: int, filters: Dict[str, Any]) -> AsyncIterator[bytes]:
+        stream = ZipStream()
+        archive = zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=self.compression_level)
+        count = 0
+        last_id = 0
+        
+        # Своя сессия: ответ отдается дольше, чем живет сессия запроса
+        async with AsyncSessionLocal() as db:
+            rows = await db.stream(
+                self.filtered(select(GeneratedCode.id, GeneratedCode.requirements, GeneratedCode.language,
+                                     GeneratedCode.created_at, GeneratedCode.generated_code), user_id, filters)
+                .execution_options(yield_per=self.chunk_rows)
+            )
+            async for row in rows:
+                info = zipfile.ZipInfo(generation_file_name(row), date_time=row.created_at.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, row.generated_code or "")
+                count += 1
+                last_id = max(last_id, row.id)
+                chunk = stream.take()
+                if chunk:
+                    yield chunk
+            
+            # Манифест - вторым проходом только по метаданным, чтобы не копить описания в памяти.
+            # Строки, добавленные во время экспорта, в манифест не попадают.
+            manifest_rows = await db.stream(
+                self.filtered(select(*MANIFEST_COLUMNS), user_id, filters)
+                .where(GeneratedCode.id <= last_id)
+                .execution_options(yield_per=self.chunk_rows)
+            )
+            with archive.open("manifest.json", "w") as manifest:
+                header = {
+                    "exported_at": datetime.now().isoformat(),
+                    "count": count,
+                    "filters": {key: str(value) for key, value in filters.items() if value is not None}
+                }
+                # Заголовок без закрывающей скобки, дальше массив generations пишется по одной записи
+                manifest.write(json.dumps(header, ensure_ascii=False)[:-1].encode() + b', "generations": [\n')
+                separator = b""
+                async for row in manifest_rows:
+                    entry = {
+                        "id": row.id,
+                        "file": generation_file_name(row),
+                        "requirements": row.requirements,
+                        "language": row.language,
+                        "framework": row.framework,
+                        "status": row.status,
+                        "lines_of_code": row.lines_of_code,
+                        "project_id": row.project_id,
+                        "template_id": row.template_id,
+                        "created_at": row.created_at.isoformat(),
+                        "sha256": row.code_hash
+                    }
+                    manifest.write(separator + json.dumps(entry, ensure_ascii=False).encode())
+                    separator = b",\n"
+                    chunk = stream.take()
+                    if chunk:
+                        yield chunk
+                manifest.write(b"\n]}\n")
+        
+        archive.close()
+        yield stream.take()
+
+generation_export = GenerationExportService()
@@ -0,0 +1,236 @@
+import os
+import json
+import asyncio
+from collections import deque
+from typing import Optional, Dict, Any, List
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+from database import AsyncSessionLocal, async_engine, GeneratedCode, CodeBlob
+from compression import COMPRESSION_MIN_BYTES
+from services import code_generator
+from dependencies import validate_code_background
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+GENERATION_QUEUE_SIZE = int(os.getenv("GENERATION_QUEUE_SIZE", "100"))
+# Фоновое сжатие старых строк: размер пачки и пауза между пачками
+COMPRESSION_BACKFILL_BATCH = int(os.getenv("COMPRESSION_BACKFILL_BATCH", "200"))
+COMPRESSION_BACKFILL_PAUSE_SECONDS = float(os.getenv("COMPRESSION_BACKFILL_PAUSE_SECONDS", "0.5"))
+
+class QueueFullError(Exception):
+    pass
+
+# Очередь задач генерации с ограниченным пулом воркеров.
+# Задачи каждого пользователя лежат в своей очереди, воркеры обходят пользователей по кругу,
+# поэтому один пользователь с десятком задач не задерживает остальных.
+class GenerationJobQueue:
+    def __init__(self, workers: int = GENERATION_WORKERS, max_size: int = GENERATION_QUEUE_SIZE):
+        self.workers = workers
+        self.max_size = max_size
+        self.user_queues: Dict[int, deque] = {}
+        self.ready_users: deque = deque()
+        self.size = 0
+        self.active = 0
+        self._available: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    def is_full(self) -> bool:
+        return self.size >= self.max_size
+    
+    def submit(self, code_id: int, user_id: int, use_cache: bool = True):
+        if self.is_full():
+            raise QueueFullError("Очередь генерации переполнена")
+        
+        job = {"code_id": code_id, "user_id": user_id, "use_cache": use_cache}
+        user_queue = self.user_queues.get(user_id)
+        if user_queue is None:
+            user_queue = self.user_queues[user_id] = deque()
+        if not user_queue:
+            self.ready_users.append(user_id)
+        user_queue.append(job)
+        
+        self.size += 1
+        if self._available is not None:
+            self._available.release()
+    
+    def _next_job(self) -> Dict[str, Any]:
+        user_id = self.ready_users.popleft()
+        user_queue = self.user_queues[user_id]
+        job = user_queue.popleft()
+        if user_queue:
+            self.ready_users.append(user_id)
+        else:
+            del self.user_queues[user_id]
+        self.size -= 1
+        return job
+    
+    async def start(self):
+        self._available = asyncio.Semaphore(self.size)
+        await self._requeue_unfinished()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"Запущено воркеров генерации: {self.workers}")
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _requeue_unfinished(self):
+        # Задачи очереди, прерванные перезапуском сервера, снова ставим в очередь с их флагом use_cache
+        async with AsyncSessionLocal() as db:
+            unfinished = (await db.execute(
+                select(GeneratedCode.id, GeneratedCode.user_id, GeneratedCode.job_use_cache).where(
+                    GeneratedCode.status.in_(["queued", "generating"]),
+                    GeneratedCode.job_use_cache.is_not(None)
+                ).order_by(GeneratedCode.id)
+            )).all()
+            
+            # Потоковые генерации без клиента не повторяем: это новый платный вызов модели,
+            # который перезаписал бы частичный результат. Строку закрываем с тем, что успело сохраниться.
+            await db.execute(
+                update(GeneratedCode)
+                .where(GeneratedCode.status == "generating", GeneratedCode.job_use_cache.is_(None))
+                .values(
+                    status="error",
+                    validation_errors=json.dumps(["Генерация прервана перезапуском сервера"], ensure_ascii=False)
+                )
+            )
+            await db.commit()
+        
+        skipped = []
+        for code_id, user_id, use_cache in unfinished:
+            if self.is_full():
+                skipped.append(code_id)
+            else:
+                self.submit(code_id, user_id, use_cache)
+        
+        if skipped:
+            # Не поместившиеся задачи иначе остались бы queued навсегда: закрываем их с пояснением
+            print(f"Очередь генерации заполнена, не восстановлено задач: {len(skipped)} (id {skipped})")
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(GeneratedCode)
+                    .where(GeneratedCode.id.in_(skipped))
+                    .values(
+                        status="error",
+                        validation_errors=json.dumps(
+                            ["Задача не восстановлена после перезапуска сервера: очередь заполнена"], ensure_ascii=False
+                        )
+                    )
+                )
+                await db.commit()
+    
+    async def _worker(self, worker_id: int):
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            self.active += 1
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                print(f"Ошибка в воркере генерации {worker_id}: {e}")
+            finally:
+                self.active -= 1
+    
+    async def _run_job(self, job: Dict[str, Any]):
+        async with AsyncSessionLocal() as db:
+            generated_code = await db.get(GeneratedCode, job["code_id"])
+            if not generated_code:
+                return
+            
+            generated_code.status = "generating"
+            await db.commit()
+            
+            try:
+                result = await code_generator.generate_code_async(
+                    generated_code.requirements,
+                    generated_code.language,
+                    generated_code.framework,
+                    db=db,
+                    use_cache=job["use_cache"]
+                )
+            except Exception as e:
+                await db.rollback()
+                # После rollback атрибуты истекли; в асинхронной сессии их нужно загрузить явно
+                await db.refresh(generated_code)
+                generated_code.status = "error"
+                generated_code.validation_errors = json.dumps([f"Ошибка генерации: {e}"])
+                await db.commit()
+                return
+            
+            generated_code.generated_code = result["generated_code"]
+            generated_code.lines_of_code = result["lines_of_code"]
+            generated_code.status = result["status"]
+            await db.commit()
+            
+            await validate_code_background(generated_code.id, result["generated_code"], result["language"])
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.size,
+            "active_jobs": self.active,
+            "workers": self.workers,
+            "max_queue_size": self.max_size
+        }
+
+# Сжатие строк с кодом, записанных до появления CompressedText.
+# Идет небольшими пачками по возрастанию id с паузами, чтобы не занимать базу надолго.
+# Значение пересчитывается SQL-функцией compress_text внутри UPDATE, поэтому запись,
+# изменившаяся между выборкой и обновлением, не перезаписывается старым текстом.
+class CompressionBackfill:
+    def __init__(self, batch_size: int = COMPRESSION_BACKFILL_BATCH, pause: float = COMPRESSION_BACKFILL_PAUSE_SECONDS):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.columns = [CodeBlob.body]
+        self.processed = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        # В других СУБД сжатие не используется (см. compression.py)
+        if async_engine.dialect.name != "sqlite":
+            return
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _run(self):
+        try:
+            for column in self.columns:
+                last_id = 0
+                while last_id is not None:
+                    async with AsyncSessionLocal() as db:
+                        last_id = await db.run_sync(self._compress_batch, column, last_id)
+                    await asyncio.sleep(self.pause)
+            if self.processed:
+                print(f"Фоновое сжатие завершено, обработано строк: {self.processed}. "
+                      f"Чтобы уменьшить файл базы, выполните VACUUM")
+        except Exception as e:
+            print(f"Ошибка фонового сжатия: {e}")
+    
+    def _compress_batch(self, db: Session, column, last_id: int) -> Optional[int]:
+        # Возвращает id последней обработанной строки или None, если строк не осталось
+        table = column.class_.__table__
+        uncompressed = [
+            func.typeof(table.c[column.key]) == "text",
+            func.length(table.c[column.key]) >= COMPRESSION_MIN_BYTES
+        ]
+        ids = db.scalars(
+            select(table.c.id).where(table.c.id > last_id, *uncompressed).order_by(table.c.id).limit(self.batch_size)
+        ).all()
+        if not ids:
+            return None
+        
+        db.execute(
+            update(table).where(table.c.id.in_(ids), *uncompressed)
+            .values({column.key: func.compress_text(table.c[column.key])})
+        )
+        db.commit()
+        self.processed += len(ids)
+        return ids[-1]
+
+generation_queue = GenerationJobQueue()
+compression_backfill = CompressionBackfill()
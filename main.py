@@ -6,15 +6,37 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import uvicorn
-from database import init_demo_data, engine, Base
+from database import init_demo_data, engine, async_engine, Base, SessionLocal
 from routes import router
+from stats import stats_service
+from search import template_search, generation_search
+from jobs import generation_queue, compression_backfill
+from services import validation_executor
+from migrations import run_migrations
+from passwords import password_hasher
+from response_compression import ResponseCompressionMiddleware
+# Обработчики flush, сохраняющие тела кода в code_blobs
+import blobs
+
+print(f"База данных: {engine.url.render_as_string(hide_password=True)}")
 
 # Создаем таблицы
 Base.metadata.create_all(bind=engine)
 
+# Миграции схемы для баз, созданных предыдущими версиями
+run_migrations()
+
+# Полнотекстовые индексы (до демо-данных, чтобы триггеры проиндексировали их сразу)
+template_search.ensure_index(engine)
+generation_search.ensure_index(engine)
+
 # Инициализация демо-шаблонов
 init_demo_data()
 
+# Пересчет счетчиков статистики (могли разойтись, пока приложение не работало)
+with SessionLocal() as db:
+    stats_service.rebuild(db)
+
 app = FastAPI(
     title="Система автоматической генерации кода",
     description="Веб-приложение для автоматической генерации программного кода",
@@ -29,6 +51,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие HTML-страниц и JSON с кодом (пороги и типы - в response_compression.py)
+app.add_middleware(ResponseCompressionMiddleware)
+
+@app.on_event("startup")
+async def start_generation_workers():
+    await generation_queue.start()
+    await compression_backfill.start()
+
+@app.on_event("shutdown")
+async def stop_generation_workers():
+    await compression_backfill.stop()
+    await generation_queue.stop()
+    validation_executor.shutdown()
+    password_hasher.shutdown()
+    await async_engine.dispose()
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(router)
 
@@ -0,0 +1,191 @@
+"""
+Версионные миграции схемы базы данных.
+
+Миграция - функция, которая получает соединение и меняет схему; выполненные версии записываются
+в таблицу schema_migrations. Новая база создается через Base.metadata.create_all и уже содержит
+все колонки и индексы из моделей, поэтому миграции проверяют наличие объекта перед созданием.
+
+Запуск из командной строки:
+    python migrations.py status
+    python migrations.py upgrade [--to ВЕРСИЯ]
+"""
+import argparse
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import inspect, text
+from database import engine, Base, SchemaMigration
+from search import template_search, generation_search
+from compression import decompress_text
+from blobs import acquire_blob
+
+MIGRATIONS: Dict[int, Tuple[str, Callable]] = {}
+
+def migration(version: int, description: str):
+    def decorator(fn):
+        if version in MIGRATIONS:
+            raise ValueError(f"Миграция {version} уже зарегистрирована")
+        MIGRATIONS[version] = (description, fn)
+        return fn
+    return decorator
+
+def add_column(conn, table: str, column: str, ddl: str):
+    columns = [col['name'] for col in inspect(conn).get_columns(table)]
+    if column not in columns:
+        print(f"Добавляем столбец {column} в таблицу {table}...")
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+def create_index(conn, table: str, name: str, columns: List[str]):
+    indexes = [index['name'] for index in inspect(conn).get_indexes(table)]
+    if name not in indexes:
+        print(f"Создаем индекс {name}...")
+        conn.execute(text(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})'))
+
+def drop_index(conn, table: str, name: str):
+    indexes = [index['name'] for index in inspect(conn).get_indexes(table)]
+    if name in indexes:
+        print(f"Удаляем индекс {name}...")
+        if conn.dialect.name == "mysql":
+            conn.execute(text(f'DROP INDEX {name} ON {table}'))
+        else:
+            conn.execute(text(f'DROP INDEX {name}'))
+
+@migration(1, "Столбцы users.hashed_password, users.bio и счетчики генераций в system_counters")
+def add_legacy_columns(conn):
+    # Бывшая check_and_add_columns: базы, созданные до появления этих столбцов
+    add_column(conn, 'users', 'hashed_password', 'VARCHAR(255)')
+    add_column(conn, 'users', 'bio', 'TEXT')
+    for column in ('total_generations', 'total_generated_lines'):
+        add_column(conn, 'system_counters', column, 'INTEGER NOT NULL DEFAULT 0')
+
+@migration(2, "Индекс истории генераций generated_codes (user_id, created_at, id)")
+def add_generation_history_index(conn):
+    # История и поиск фильтруют по user_id и сортируют по (created_at, id) - порядок keyset-пагинации.
+    # Составной индекс отдает страницу без сортировки и заменяет одиночный индекс по user_id.
+    create_index(conn, 'generated_codes', 'ix_generated_codes_user_created', ['user_id', 'created_at', 'id'])
+    drop_index(conn, 'generated_codes', 'ix_generated_codes_user_id')
+
+@migration(3, "Индексы фильтров и порядка страниц библиотеки шаблонов")
+def add_template_indexes(conn):
+    # Фильтры /api/templates и списки категорий и языков на странице шаблонов
+    create_index(conn, 'templates', 'ix_templates_public_filters', ['is_public', 'language', 'category', 'framework'])
+    # Страницы без фильтров: is_public = true в порядке (created_at, id)
+    create_index(conn, 'templates', 'ix_templates_public_created', ['is_public', 'created_at', 'id'])
+
+@migration(4, "Индекс порядка страниц проектов projects (created_at, id)")
+def add_project_index(conn):
+    create_index(conn, 'projects', 'ix_projects_created', ['created_at', 'id'])
+
+@migration(5, "Полнотекстовые индексы читают код через decompress_text")
+def rebuild_fulltext_indexes(conn):
+    # Код может храниться сжатым, поэтому старые триггеры, индексирующие колонку как есть, заменяются.
+    # Индексы создаются заново и перестраиваются при старте приложения (ensure_index).
+    if conn.dialect.name != "sqlite":
+        return
+    for index in (template_search.index, generation_search.index):
+        index.drop(conn)
+
+@migration(6, "Тела кода в общей таблице code_blobs с подсчетом ссылок")
+def move_code_to_blobs(conn):
+    # Триггеры полнотекстового индекса ссылаются на старые колонки; индексы пересоздаются при старте
+    if conn.dialect.name == "sqlite":
+        for index in (template_search.index, generation_search.index):
+            index.drop(conn)
+    
+    for table, column in (('templates', 'code'), ('generated_codes', 'generated_code')):
+        add_column(conn, table, 'code_hash', 'VARCHAR(64)')
+        if column not in [col['name'] for col in inspect(conn).get_columns(table)]:
+            continue
+        
+        print(f"Переносим {table}.{column} в code_blobs...")
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                text(f'SELECT id, {column} FROM {table} WHERE id > :last_id ORDER BY id LIMIT 500'),
+                {"last_id": last_id}
+            ).all()
+            if not rows:
+                break
+            for row_id, body in rows:
+                body = decompress_text(body)
+                if body is not None:
+                    conn.execute(
+                        text(f'UPDATE {table} SET code_hash = :hash WHERE id = :id'),
+                        {"hash": acquire_blob(conn, body), "id": row_id}
+                    )
+            last_id = rows[-1][0]
+        
+        conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+
+@migration(7, "Столбец updated_at у templates, generated_codes и system_counters для условных запросов")
+def add_updated_at(conn):
+    for table, source in (('templates', 'created_at'), ('generated_codes', 'created_at'), ('system_counters', 'rebuilt_at')):
+        add_column(conn, table, 'updated_at', 'DATETIME')
+        conn.execute(text(f'UPDATE {table} SET updated_at = {source} WHERE updated_at IS NULL'))
+
+@migration(8, "Столбец generated_codes.job_use_cache: задачи очереди и их флаг use_cache")
+def add_job_use_cache(conn):
+    add_column(conn, 'generated_codes', 'job_use_cache', 'BOOLEAN')
+    # Незавершенные строки, созданные до появления столбца, считаем задачами очереди с кешем по умолчанию
+    conn.execute(
+        text("UPDATE generated_codes SET job_use_cache = :use_cache WHERE status = 'queued'"),
+        {"use_cache": True}
+    )
+
+def applied_versions(conn) -> Dict[int, datetime]:
+    return {version: applied_at for version, applied_at in conn.execute(
+        text('SELECT version, applied_at FROM schema_migrations')
+    )}
+
+def run_migrations(target: Optional[int] = None) -> List[int]:
+    # Применяет невыполненные миграции по возрастанию версии; каждая миграция - отдельная транзакция
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+    
+    done = []
+    for version in sorted(MIGRATIONS):
+        if version in applied or (target is not None and version > target):
+            continue
+        description, fn = MIGRATIONS[version]
+        print(f"Миграция {version}: {description}")
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                SchemaMigration.__table__.insert().values(
+                    version=version, description=description, applied_at=datetime.now()
+                )
+            )
+        done.append(version)
+    return done
+
+def print_status():
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+    
+    for version in sorted(MIGRATIONS):
+        description, _ = MIGRATIONS[version]
+        state = applied[version] if version in applied else "не применена"
+        print(f"{version:>4}  {state}  {description}")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="список миграций и их состояние")
+    upgrade = commands.add_parser("upgrade", help="применить невыполненные миграции")
+    upgrade.add_argument("--to", type=int, default=None, help="последняя применяемая версия")
+    args = parser.parse_args(argv)
+    
+    if args.command == "status":
+        print_status()
+    elif args.command == "upgrade":
+        # Таблицы, которых еще нет в базе, создаются по моделям, как при старте приложения
+        Base.metadata.create_all(bind=engine)
+        done = run_migrations(args.to)
+        template_search.ensure_index(engine)
+        generation_search.ensure_index(engine)
+        print(f"Применено миграций: {len(done)}" if done else "Схема в актуальном состоянии")
+
+if __name__ == "__main__":
+    main()
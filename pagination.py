@@ -0,0 +1,47 @@
+"""
+Курсорная (keyset) пагинация по (created_at, id).
+
+Следующая страница выбирается условием "строго раньше последней записи предыдущей страницы",
+поэтому стоимость запроса не зависит от того, насколько глубоко пролистан список, в отличие от OFFSET.
+"""
+import json
+import base64
+from datetime import datetime
+from typing import Optional, Tuple, List, Any
+from fastapi import HTTPException
+from sqlalchemy import or_, and_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации")
+
+def paginate_keyset(query, model, cursor: Optional[str], limit: int) -> Tuple[List[Any], Optional[str]]:
+    # Возвращает строки страницы (от новых к старым) и курсор следующей страницы или None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < row_id)
+        ))
+    
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    
+    return rows, next_cursor
@@ -0,0 +1,140 @@
+"""
+Хеширование паролей.
+
+Поддерживаются scrypt (по умолчанию, требует много памяти) и PBKDF2-SHA256 из стандартной библиотеки.
+Алгоритм и параметры стоимости хранятся в самом хеше, поэтому смена настроек не ломает старые пароли:
+хеш, созданный с другими параметрами или старым форматом "salt:sha256", пересчитывается при следующем входе.
+
+Вычисление хеша занимает десятки миллисекунд, поэтому асинхронный код выполняет его
+в отдельном пуле потоков, а не в event loop.
+"""
+import os
+import base64
+import hashlib
+import hmac
+import secrets
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple
+
+PASSWORD_HASH_ALGORITHM = os.getenv("PASSWORD_HASH_ALGORITHM", "scrypt")
+# Стоимость scrypt: n - степень двойки (память ~ 128 * n * r байт), r - размер блока, p - параллелизм
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 15)))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+# Потоки для хеширования: ограничивают, сколько входов одновременно занимают процессор
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+# Старый формат обрезал пароль до 50 символов
+LEGACY_PASSWORD_LENGTH = 50
+
+def b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+def b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+class PasswordHasher:
+    def __init__(self, algorithm: str = PASSWORD_HASH_ALGORITHM, workers: int = PASSWORD_HASH_WORKERS):
+        if algorithm not in ("scrypt", "pbkdf2-sha256"):
+            raise ValueError(f"Неизвестный алгоритм хеширования паролей: {algorithm}")
+        self.algorithm = algorithm
+        self.workers = workers
+        self.scrypt_params = {"n": PASSWORD_SCRYPT_N, "r": PASSWORD_SCRYPT_R, "p": PASSWORD_SCRYPT_P}
+        self.pbkdf2_iterations = PASSWORD_PBKDF2_ITERATIONS
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._dummy_hash: Optional[str] = None
+    
+    @staticmethod
+    def _scrypt(password: str, salt: bytes, params: Dict[str, int]) -> bytes:
+        n, r, p = params["n"], params["r"], params["p"]
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p,
+            maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES
+        )
+    
+    @staticmethod
+    def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=HASH_BYTES)
+    
+    @staticmethod
+    def _parse(hashed: str) -> Tuple[str, str, bytes, bytes]:
+        # "$алгоритм$параметры$соль$хеш"
+        _, algorithm, params, salt, digest = hashed.split("$")
+        return algorithm, params, b64decode(salt), b64decode(digest)
+    
+    def _params(self) -> str:
+        if self.algorithm == "scrypt":
+            return ",".join(f"{key}={value}" for key, value in self.scrypt_params.items())
+        return str(self.pbkdf2_iterations)
+    
+    def hash(self, password: str) -> str:
+        salt = secrets.token_bytes(SALT_BYTES)
+        if self.algorithm == "scrypt":
+            digest = self._scrypt(password, salt, self.scrypt_params)
+        else:
+            digest = self._pbkdf2(password, salt, self.pbkdf2_iterations)
+        return f"${self.algorithm}${self._params()}${b64encode(salt)}${b64encode(digest)}"
+    
+    def verify(self, password: str, hashed: Optional[str]) -> bool:
+        if not hashed:
+            return False
+        try:
+            if not hashed.startswith("$"):
+                salt, stored_hash = hashed.split(":")
+                password = password[:LEGACY_PASSWORD_LENGTH]
+                return hmac.compare_digest(hashlib.sha256((password + salt).encode()).hexdigest(), stored_hash)
+            
+            algorithm, params, salt, digest = self._parse(hashed)
+            if algorithm == "scrypt":
+                scrypt_params = {key: int(value) for key, value in (item.split("=") for item in params.split(","))}
+                computed = self._scrypt(password, salt, scrypt_params)
+            elif algorithm == "pbkdf2-sha256":
+                computed = self._pbkdf2(password, salt, int(params))
+            else:
+                return False
+            return hmac.compare_digest(computed, digest)
+        except (ValueError, KeyError):
+            return False
+    
+    def verify_dummy(self, password: str) -> bool:
+        # Для несуществующего пользователя: та же работа, что и при неверном пароле,
+        # чтобы по времени ответа нельзя было узнать, есть ли такое имя
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash(secrets.token_urlsafe(SALT_BYTES))
+        self.verify(password, self._dummy_hash)
+        return False
+    
+    def needs_rehash(self, hashed: Optional[str]) -> bool:
+        # True для старого формата и для хешей с другим алгоритмом или стоимостью
+        if not hashed or not hashed.startswith("$"):
+            return True
+        try:
+            algorithm, params, _, _ = self._parse(hashed)
+        except ValueError:
+            return True
+        return algorithm != self.algorithm or params != self._params()
+    
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._pool
+    
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self._get_pool(), self.hash, password)
+    
+    async def verify_async(self, password: str, hashed: Optional[str]) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self._get_pool(), self.verify, password, hashed)
+    
+    async def verify_dummy_async(self, password: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self._get_pool(), self.verify_dummy, password)
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,150 @@
+"""
+Сжатие HTTP-ответов (gzip).
+
+Самые тяжелые ответы - JSON с кодом: /api/generated-codes/{id}, /api/templates/{id}, результаты
+/api/generate и пакетной генерации. Это до сотен килобайт хорошо сжимаемого текста; так же сжимаются
+HTML-страницы со списками шаблонов и генераций и статические CSS/JS.
+
+Middleware сжимает ответ, если клиент принимает gzip, тип содержимого есть в списке
+RESPONSE_COMPRESSION_TYPES и тело не меньше RESPONSE_COMPRESSION_MIN_BYTES.
+
+Не сжимаются:
+- потоки событий (text/event-stream не входит в список типов);
+- ZIP-архивы (уже сжаты);
+- ответы с Accept-Ranges: bytes. Диапазоны байт в них относятся к несжатому файлу,
+  и докачка сжатого ответа была бы невозможна.
+Потоковые ответы сжимаются по частям: каждая часть сбрасывается клиенту сразу (Z_SYNC_FLUSH).
+"""
+import os
+import zlib
+from typing import Iterable, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "6"))
+RESPONSE_COMPRESSION_TYPES = os.getenv(
+    "RESPONSE_COMPRESSION_TYPES",
+    "text/html,text/plain,text/css,text/javascript,application/javascript,application/json,image/svg+xml"
+)
+
+# Ответы без тела или с частью файла
+UNCOMPRESSED_STATUSES = (204, 206, 304)
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    # "gzip, deflate, br", "gzip;q=0.5", "*" - gzip подходит, если его q не равен нулю
+    allowed = None
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if coding not in ("gzip", "*"):
+            continue
+        quality = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding == "gzip":
+            return quality > 0
+        allowed = quality > 0
+    return bool(allowed)
+
+class ResponseCompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = RESPONSE_COMPRESSION_MIN_BYTES,
+        level: int = RESPONSE_COMPRESSION_LEVEL,
+        content_types: Iterable[str] = RESPONSE_COMPRESSION_TYPES.split(",")
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.content_types = {content_type.strip().lower() for content_type in content_types if content_type.strip()}
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        gzip_allowed = accepts_gzip(Headers(scope=scope).get("accept-encoding"))
+        await CompressionResponder(self, send, gzip_allowed).run(scope, receive)
+    
+    def compressible(self, headers: Headers) -> bool:
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return (
+            media_type in self.content_types
+            and "content-encoding" not in headers
+            and headers.get("accept-ranges", "").lower() != "bytes"
+        )
+
+class CompressionResponder:
+    # Состояние одного ответа: заголовки придерживаются до первой части тела,
+    # по ней решается, сжимать ли ответ
+    def __init__(self, middleware: ResponseCompressionMiddleware, send: Send, gzip_allowed: bool):
+        self.middleware = middleware
+        self.send = send
+        self.gzip_allowed = gzip_allowed
+        self.start_message: Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+    
+    async def run(self, scope: Scope, receive: Receive):
+        await self.middleware.app(scope, receive, self.send_message)
+    
+    async def send_message(self, message: Message):
+        if self.passthrough:
+            await self.send(message)
+            return
+        
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+        
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        
+        if self.compressor is None and not self.begin(body, more_body):
+            self.passthrough = True
+            await self.send(self.start_message)
+            await self.send(message)
+            return
+        
+        if more_body:
+            data = self.compressor.compress(body) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            data = self.compressor.compress(body) + self.compressor.flush()
+        
+        if self.start_message is not None:
+            if not more_body:
+                # Тело целиком в одном сообщении: длина сжатого ответа известна
+                MutableHeaders(raw=self.start_message["headers"])["Content-Length"] = str(len(data))
+            await self.send(self.start_message)
+            self.start_message = None
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+    
+    def begin(self, body: bytes, more_body: bool) -> bool:
+        # Решение по заголовкам и первой части тела; True - ответ будет сжат
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if self.start_message["status"] in UNCOMPRESSED_STATUSES or not self.middleware.compressible(headers):
+            return False
+        
+        # Кеши должны хранить сжатую и несжатую версии отдельно
+        headers.add_vary_header("Accept-Encoding")
+        if not self.gzip_allowed or (not more_body and len(body) < self.middleware.minimum_size):
+            return False
+        
+        # wbits 31: формат gzip (заголовок и контрольная сумма) вместо «голого» zlib
+        self.compressor = zlib.compressobj(self.middleware.level, zlib.DEFLATED, 31)
+        headers["Content-Encoding"] = "gzip"
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        # Сжатое тело - другие байты: сильный ETag становится слабым
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        return True
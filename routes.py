@@ -1,22 +1,40 @@
 from fastapi import APIRouter, Request, Depends, HTTPException, BackgroundTasks, Response
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 import json
-import jwt
-from datetime import datetime, timedelta    
+import time
+import anyio
+from datetime import date, datetime, timedelta    
 from typing import Optional
-from database import SECRET_KEY, ALGORITHM
-from database import get_db, User, Project, Template, GeneratedCode
+from database import get_async_db, AsyncSessionLocal, run_in_session, User, Project, Template, GeneratedCode
 from schemas import (
-    CodeGenerationRequest, CodeGenerationResponse, TemplateResponse,
+    CodeGenerationRequest, CodeGenerationResponse, TemplateResponse, TemplateSummary, TemplateSearchResult,
+    GenerationJobResponse, GenerationJobStatus, BatchGenerationRequest,
+    GenerationSummary, GenerationHistoryPage, GenerationSearchItem, GenerationSearchPage,
     ProjectResponse, SystemStats, UserResponse, UserCreate, UserLogin,
     UserUpdateRequest, Token
 )
-from services import code_generator, validator, auth_service
+from services import (
+    code_generator, validation_executor, auth_service, StreamingCodeBuffer,
+    STREAM_CHECKPOINT_SECONDS, STREAM_CHECKPOINT_CHARS, BATCH_MAX_ITEMS
+)
+from jobs import generation_queue, QueueFullError
+from stats import stats_service
+from search import template_search, generation_search
+from pagination import paginate_keyset, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from passwords import password_hasher
+from export import generation_export
+from downloads import code_file_response, file_extension, file_slug
+from caching import (
+    conditional_response, collection_validators, make_etag,
+    CACHE_CONTROL_TEMPLATES, CACHE_CONTROL_PROJECTS, CACHE_CONTROL_STATS, CACHE_CONTROL_GENERATION
+)
 from dependencies import (
-    get_current_user, get_current_user_dependency, 
-    get_user_context, validate_code_background, templates
+    get_current_user_dependency, resolve_user, user_token_cache,
+    get_user_context, validate_code_background, validate_codes_background, apply_validation_result, templates
 )
 
 router = APIRouter()
@@ -28,13 +46,18 @@ async def generate_code(
     request: CodeGenerationRequest,
     background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user_dependency),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    if request.as_job:
+        return await enqueue_generation_job(request, current_user, db)
+    
     try:
-        result = code_generator.generate_code(
+        result = await code_generator.generate_code_async(
             request.requirements,
             request.language,
-            request.framework
+            request.framework,
+            db=db,
+            use_cache=request.use_cache
         )
         
         generated_code = GeneratedCode(
@@ -50,12 +73,11 @@ async def generate_code(
         )
         
         db.add(generated_code)
-        db.commit()
-        db.refresh(generated_code)
+        await db.commit()
+        await db.refresh(generated_code)
         
         background_tasks.add_task(
             validate_code_background,
-            db,
             generated_code.id,
             result["generated_code"],
             result["language"]
@@ -69,28 +91,405 @@ async def generate_code(
             framework=generated_code.framework,
             lines_of_code=generated_code.lines_of_code,
             status=generated_code.status,
+            source=result["source"],
             created_at=generated_code.created_at
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def enqueue_generation_job(request: CodeGenerationRequest, current_user: User, db: AsyncSession):
+    if generation_queue.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="Очередь генерации переполнена, попробуйте позже",
+            headers={"Retry-After": "10"}
+        )
+    
+    generated_code = GeneratedCode(
+        requirements=request.requirements,
+        generated_code="",
+        language=request.language,
+        framework=request.framework,
+        lines_of_code=0,
+        status="queued",
+        user_id=current_user.id,
+        project_id=request.project_id,
+        template_id=request.template_id,
+        job_use_cache=request.use_cache
+    )
+    db.add(generated_code)
+    await db.commit()
+    await db.refresh(generated_code)
+    
+    try:
+        generation_queue.submit(generated_code.id, current_user.id, request.use_cache)
+    except QueueFullError as e:
+        await db.delete(generated_code)
+        await db.commit()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    
+    job = GenerationJobResponse(
+        job_id=generated_code.id,
+        status=generated_code.status,
+        status_url=f"/api/generate/jobs/{generated_code.id}"
+    )
+    return JSONResponse(status_code=202, content=jsonable_encoder(job))
+
+@router.get("/api/generate/jobs/{job_id}", response_model=GenerationJobStatus)
+async def get_generation_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user_dependency),
+    db: AsyncSession = Depends(get_async_db)
+):
+    generated_code = await db.get(GeneratedCode, job_id)
+    
+    if not generated_code:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    
+    if generated_code.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Нет доступа к этой задаче")
+    
+    finished = generated_code.status in ("generated", "validated", "error")
+    
+    return GenerationJobStatus(
+        job_id=generated_code.id,
+        status=generated_code.status,
+        language=generated_code.language,
+        framework=generated_code.framework,
+        lines_of_code=generated_code.lines_of_code,
+        generated_code=generated_code.generated_code if finished else None,
+        validation_errors=generated_code.validation_errors,
+        optimization_suggestions=generated_code.optimization_suggestions,
+        created_at=generated_code.created_at
+    )
+
+@router.post("/api/generate/batch", response_model=list[CodeGenerationResponse])
+async def generate_code_batch(
+    request: BatchGenerationRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user_dependency),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Пакет не содержит запросов")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"В пакете не может быть больше {BATCH_MAX_ITEMS} запросов"
+        )
+    
+    try:
+        results = await code_generator.generate_batch_async(
+            [item.model_dump() for item in request.items],
+            db=db
+        )
+        
+        generated_codes = [
+            GeneratedCode(
+                requirements=item.requirements,
+                generated_code=result["generated_code"],
+                language=result["language"],
+                framework=result["framework"],
+                lines_of_code=result["lines_of_code"],
+                status=result["status"],
+                user_id=current_user.id,
+                project_id=item.project_id,
+                template_id=item.template_id
+            )
+            for item, result in zip(request.items, results)
+        ]
+        
+        # Одна пакетная вставка; id и created_at известны после flush, без refresh каждой строки
+        db.add_all(generated_codes)
+        await db.flush()
+        
+        response = [
+            CodeGenerationResponse(
+                id=generated_code.id,
+                requirements=generated_code.requirements,
+                generated_code=generated_code.generated_code,
+                language=generated_code.language,
+                framework=generated_code.framework,
+                lines_of_code=generated_code.lines_of_code,
+                status=generated_code.status,
+                source=result["source"],
+                created_at=generated_code.created_at
+            )
+            for generated_code, result in zip(generated_codes, results)
+        ]
+        
+        await db.commit()
+        
+        background_tasks.add_task(
+            validate_codes_background,
+            [(item.id, item.generated_code, item.language) for item in response]
+        )
+        
+        return response
+        
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/api/generate/stream")
+async def generate_code_stream(
+    request: CodeGenerationRequest,
+    current_user: User = Depends(get_current_user_dependency)
+):
+    user_id = current_user.id
+    
+    async def event_stream():
+        # Своя сессия: сессия запроса может быть закрыта раньше, чем закончится поток
+        db = AsyncSessionLocal()
+        buffer = StreamingCodeBuffer()
+        generated_code = None
+        
+        async def save_unfinished(reason: str):
+            # Сохраняем то, что успело прийти, и закрываем строку статусом error
+            if generated_code is None or not generated_code.id or generated_code.status != "generating":
+                return
+            await db.rollback()
+            # После rollback атрибуты истекли; в асинхронной сессии их нужно загрузить явно
+            await db.refresh(generated_code)
+            generated_code.generated_code = buffer.text
+            generated_code.lines_of_code = buffer.lines_of_code
+            generated_code.status = "error"
+            generated_code.validation_errors = json.dumps([reason], ensure_ascii=False)
+            await db.commit()
+        
+        try:
+            generated_code = GeneratedCode(
+                requirements=request.requirements,
+                generated_code="",
+                language=request.language,
+                framework=request.framework,
+                lines_of_code=0,
+                status="generating",
+                user_id=user_id,
+                project_id=request.project_id,
+                template_id=request.template_id
+            )
+            db.add(generated_code)
+            await db.commit()
+            await db.refresh(generated_code)
+            
+            yield sse_event("start", {"id": generated_code.id})
+            
+            last_checkpoint = time.monotonic()
+            unsaved_chars = 0
+            source = None
+            
+            async for source, delta in code_generator.stream_code_async(
+                request.requirements,
+                request.language,
+                request.framework,
+                db=db,
+                use_cache=request.use_cache
+            ):
+                text = buffer.feed(delta)
+                if not text:
+                    continue
+                
+                unsaved_chars += len(text)
+                yield sse_event("token", {"text": text})
+                
+                # Периодически сохраняем частичный результат
+                if unsaved_chars >= STREAM_CHECKPOINT_CHARS or \
+                        time.monotonic() - last_checkpoint >= STREAM_CHECKPOINT_SECONDS:
+                    generated_code.generated_code = buffer.text
+                    generated_code.lines_of_code = buffer.lines_of_code
+                    await db.commit()
+                    last_checkpoint = time.monotonic()
+                    unsaved_chars = 0
+            
+            text = buffer.finish()
+            if text:
+                yield sse_event("token", {"text": text})
+            
+            generated_code.generated_code = buffer.text
+            generated_code.lines_of_code = buffer.lines_of_code
+            generated_code.status = "generated"
+            await db.commit()
+            
+            await validate_code_background(generated_code.id, buffer.text, request.language)
+            await db.refresh(generated_code)
+            
+            yield sse_event("done", {
+                "id": generated_code.id,
+                "language": generated_code.language,
+                "framework": generated_code.framework,
+                "lines_of_code": generated_code.lines_of_code,
+                "status": generated_code.status,
+                "source": source
+            })
+        except Exception as e:
+            print(f"Ошибка при потоковой генерации: {e}")
+            await save_unfinished(f"Ошибка генерации: {e}")
+            yield sse_event("error", {"detail": str(e)})
+        except BaseException:
+            # Клиент отключился (CancelledError или GeneratorExit): отправить событие уже некому,
+            # но частичный результат сохраняем, иначе строка навсегда останется в статусе generating.
+            # Запрос к этому моменту уже отменен, поэтому без экранирования отмены любой await
+            # в save_unfinished сразу получил бы CancelledError
+            with anyio.CancelScope(shield=True):
+                try:
+                    await save_unfinished("Генерация прервана: клиент отключился")
+                except Exception as e:
+                    print(f"Не удалось сохранить прерванную генерацию: {e}")
+            raise
+        finally:
+            with anyio.CancelScope(shield=True):
+                await db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/api/generate/load")
+async def get_generation_load():
+    return {**code_generator.get_load(), **generation_queue.get_stats()}
+
+def generation_history_query(db: Session, user_id: int):
+    # Для списков тело сгенерированного кода не загружаем
+    return db.query(GeneratedCode).options(
+        load_only(
+            GeneratedCode.id, GeneratedCode.requirements, GeneratedCode.language,
+            GeneratedCode.framework, GeneratedCode.lines_of_code, GeneratedCode.status,
+            GeneratedCode.created_at
+        )
+    ).filter(GeneratedCode.user_id == user_id)
+
+def load_generation_history_page(db: Session, user_id: int, cursor: Optional[str], limit: int):
+    return paginate_keyset(generation_history_query(db, user_id), GeneratedCode, cursor, limit)
+
+@router.get("/api/generated-codes", response_model=GenerationHistoryPage)
+async def get_generation_history(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    current_user: User = Depends(get_current_user_dependency),
+    db: AsyncSession = Depends(get_async_db)
+):
+    generations, next_cursor = await run_in_session(
+        db, load_generation_history_page, current_user.id, cursor, limit
+    )
+    
+    return GenerationHistoryPage(
+        items=[
+            GenerationSummary(
+                id=generation.id,
+                requirements=generation.requirements,
+                language=generation.language,
+                framework=generation.framework,
+                lines_of_code=generation.lines_of_code,
+                status=generation.status,
+                created_at=generation.created_at
+            )
+            for generation in generations
+        ],
+        next_cursor=next_cursor
+    )
+
+@router.get("/api/generated-codes/export")
+async def export_generation_history(
+    language: Optional[str] = None,
+    project_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    current_user: User = Depends(get_current_user_dependency)
+):
+    filters = {"language": language, "project_id": project_id, "date_from": date_from, "date_to": date_to}
+    file_name = f"generations-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        generation_export.stream_archive(current_user.id, filters),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+@router.get("/api/generated-codes/search", response_model=GenerationSearchPage)
+async def search_generation_history(
+    q: Optional[str] = None,
+    language: Optional[str] = None,
+    framework: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user_dependency),
+    db: AsyncSession = Depends(get_async_db)
+):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    user_id = current_user.id
+    
+    def search(session: Session):
+        return generation_search.search(
+            generation_history_query(session, user_id),
+            user_id,
+            q,
+            {"language": language, "framework": framework, "status": status},
+            limit,
+            offset
+        )
+    
+    result = await run_in_session(db, search)
+    
+    next_offset = offset + limit if offset + limit < result["total"] else None
+    
+    return GenerationSearchPage(
+        items=[
+            GenerationSearchItem(
+                id=generation.id,
+                requirements=generation.requirements,
+                language=generation.language,
+                framework=generation.framework,
+                lines_of_code=generation.lines_of_code,
+                status=generation.status,
+                created_at=generation.created_at,
+                snippet=snippet
+            )
+            for generation, snippet in result["items"]
+        ],
+        total=result["total"],
+        facets=result["facets"],
+        next_offset=next_offset
+    )
+
 @router.get("/api/generated-codes/{code_id}")
 async def get_generated_code(
     code_id: int,
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_dependency)
 ):
-    generated_code = db.query(GeneratedCode).filter(
-        GeneratedCode.id == code_id
-    ).first()
+    # Сначала только валидаторы: при актуальной копии у клиента код из code_blobs не читается
+    version = (await db.execute(
+        select(GeneratedCode.user_id, GeneratedCode.updated_at, GeneratedCode.code_hash)
+        .where(GeneratedCode.id == code_id)
+    )).first()
     
-    if not generated_code:
+    if not version:
         raise HTTPException(status_code=404, detail="Генерация не найдена")
     
-    if current_user and generated_code.user_id != current_user.id:
+    # Генерация видна только владельцу, как и ее файл в /raw. Проверка идет до валидаторов:
+    # ни 304, ни заголовки кеширования не отдаются чужому пользователю
+    if version.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Нет доступа к этой генерации")
     
+    not_modified = conditional_response(
+        request, response,
+        make_etag("generation", code_id, version.updated_at, version.code_hash),
+        version.updated_at, CACHE_CONTROL_GENERATION
+    )
+    if not_modified:
+        return not_modified
+    
+    generated_code = await db.get(GeneratedCode, code_id)
     return {
         "id": generated_code.id,
         "requirements": generated_code.requirements,
@@ -101,16 +500,44 @@ async def get_generated_code(
         "created_at": generated_code.created_at
     }
 
-@router.get("/api/templates", response_model=list[TemplateResponse])
-async def get_templates(
-    skip: int = 0,
-    limit: int = 100,
-    language: Optional[str] = None,
-    category: Optional[str] = None,
-    framework: Optional[str] = None,
-    db: Session = Depends(get_db)
+@router.get("/api/generated-codes/{code_id}/raw")
+async def download_generated_code(
+    code_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_dependency)
 ):
-    query = db.query(Template).filter(Template.is_public == True)
+    # Тело кода не читается, пока не проверен If-None-Match
+    generation = (await db.execute(
+        select(GeneratedCode.user_id, GeneratedCode.requirements, GeneratedCode.language, GeneratedCode.code_hash)
+        .where(GeneratedCode.id == code_id)
+    )).first()
+    
+    if not generation:
+        raise HTTPException(status_code=404, detail="Генерация не найдена")
+    
+    # Файл отдается только владельцу: анонимный доступ здесь означал бы перебор чужих генераций по id
+    if generation.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Нет доступа к этой генерации")
+    
+    return await code_file_response(
+        request, db, generation.code_hash,
+        f"{code_id}-{file_slug(generation.requirements)}.{file_extension(generation.language)}",
+        cache_control=CACHE_CONTROL_GENERATION
+    )
+
+def template_summary_query(db: Session):
+    # Код шаблона в списках не нужен: он загружается отдельно через /api/templates/{id}
+    return db.query(Template).options(
+        load_only(
+            Template.id, Template.name, Template.description, Template.language,
+            Template.category, Template.framework, Template.downloads, Template.rating,
+            Template.tags, Template.is_public, Template.creator_id, Template.created_at
+        )
+    ).filter(Template.is_public == True)
+
+def filtered_template_query(db: Session, language: Optional[str], category: Optional[str], framework: Optional[str]):
+    query = template_summary_query(db)
     
     if language:
         query = query.filter(Template.language == language)
@@ -119,34 +546,146 @@ async def get_templates(
     if framework:
         query = query.filter(Template.framework == framework)
     
-    templates_list = query.offset(skip).limit(limit).all()
+    return query
+
+def template_summary_fields(template: Template) -> dict:
+    return {
+        "id": template.id,
+        "name": template.name,
+        "description": template.description,
+        "language": template.language,
+        "category": template.category,
+        "framework": template.framework,
+        "downloads": template.downloads,
+        "rating": template.rating,
+        "tags": json.loads(template.tags) if template.tags else [],
+        "is_public": template.is_public,
+        "creator_id": template.creator_id,
+        "created_at": template.created_at
+    }
+
+@router.get("/api/templates", response_model=list[TemplateSummary])
+async def get_templates(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    language: Optional[str] = None,
+    category: Optional[str] = None,
+    framework: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    count, last_modified = await run_in_session(
+        db, lambda session: collection_validators(filtered_template_query(session, language, category, framework), Template)
+    )
+    not_modified = conditional_response(
+        request, response,
+        make_etag("templates", count, last_modified, skip, limit, cursor, language, category, framework),
+        last_modified, CACHE_CONTROL_TEMPLATES
+    )
+    if not_modified:
+        return not_modified
     
-    return [
-        TemplateResponse(
-            id=template.id,
-            name=template.name,
-            description=template.description,
-            language=template.language,
-            category=template.category,
-            framework=template.framework,
-            code=template.code,
-            downloads=template.downloads,
-            rating=template.rating,
-            tags=json.loads(template.tags) if template.tags else [],
-            is_public=template.is_public,
-            creator_id=template.creator_id,
-            created_at=template.created_at
+    def load_page(session: Session):
+        query = filtered_template_query(session, language, category, framework)
+        if skip and not cursor:
+            # Старый режим со смещением: медленнее на дальних страницах
+            return query.order_by(Template.created_at.desc(), Template.id.desc()).offset(skip).limit(limit).all(), None
+        return paginate_keyset(query, Template, cursor, limit)
+    
+    templates_list, next_cursor = await run_in_session(db, load_page)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    
+    return [TemplateSummary(**template_summary_fields(template)) for template in templates_list]
+
+@router.get("/api/templates/search", response_model=list[TemplateSearchResult])
+async def search_templates(
+    q: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    offset: int = 0,
+    language: Optional[str] = None,
+    category: Optional[str] = None,
+    framework: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    def search(session: Session):
+        return template_search.search(
+            filtered_template_query(session, language, category, framework),
+            q,
+            max(1, min(limit, MAX_PAGE_SIZE)),
+            max(0, offset)
         )
-        for template in templates_list
+    
+    results = await run_in_session(db, search)
+    
+    return [
+        TemplateSearchResult(**template_summary_fields(template), score=score)
+        for template, score in results
     ]
 
+@router.get("/api/templates/{template_id}", response_model=TemplateResponse)
+async def get_template(template_id: int, db: AsyncSession = Depends(get_async_db)):
+    template = await db.scalar(select(Template).where(
+        Template.id == template_id,
+        Template.is_public == True
+    ))
+    
+    if not template:
+        raise HTTPException(status_code=404, detail="Шаблон не найден")
+    
+    return TemplateResponse(**template_summary_fields(template), code=template.code)
+
+@router.get("/api/templates/{template_id}/raw")
+async def download_template(template_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    template = (await db.execute(
+        select(Template.name, Template.language, Template.code_hash).where(
+            Template.id == template_id,
+            Template.is_public == True
+        )
+    )).first()
+    
+    if not template:
+        raise HTTPException(status_code=404, detail="Шаблон не найден")
+    
+    return await code_file_response(
+        request, db, template.code_hash,
+        f"{file_slug(template.name, 'template')}.{file_extension(template.language)}",
+        cache_control="public, no-cache"
+    )
+
 @router.get("/api/projects", response_model=list[ProjectResponse])
 async def get_projects(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    projects = db.query(Project).offset(skip).limit(limit).all()
+    count, last_modified = await run_in_session(
+        db, lambda session: collection_validators(session.query(Project), Project)
+    )
+    not_modified = conditional_response(
+        request, response,
+        make_etag("projects", count, last_modified, skip, limit, cursor),
+        last_modified, CACHE_CONTROL_PROJECTS
+    )
+    if not_modified:
+        return not_modified
+    
+    if skip and not cursor:
+        # Старый режим со смещением: медленнее на дальних страницах
+        projects = (await db.scalars(
+            select(Project).order_by(Project.created_at.desc(), Project.id.desc()).offset(skip).limit(limit)
+        )).all()
+    else:
+        projects, next_cursor = await run_in_session(
+            db, lambda session: paginate_keyset(session.query(Project), Project, cursor, limit)
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
     
     return [
         ProjectResponse(
@@ -166,48 +705,42 @@ async def get_projects(
     ]
 
 @router.get("/api/stats", response_model=SystemStats)
-async def get_stats(db: Session = Depends(get_db)):
-    total_projects = db.query(Project).count()
-    completed_projects = db.query(Project).filter(Project.status == "completed").count()
-    total_lines = db.query(func.sum(Project.lines_of_code)).scalar() or 0
-    active_projects = db.query(Project).filter(Project.status == "in_progress").count()
-    total_templates = db.query(Template).filter(Template.is_public == True).count()
-    total_users = db.query(User).count()
-    
-    return SystemStats(
-        total_projects=total_projects,
-        completed_projects=completed_projects,
-        total_lines_of_code=total_lines,
-        active_projects=active_projects,
-        total_templates=total_templates,
-        total_users=total_users
+async def get_stats(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    # Счетчики - одна строка, поэтому ETag считается по самим значениям
+    stats, last_modified = await run_in_session(
+        db, lambda session: (stats_service.get(session), stats_service.last_modified(session))
     )
+    not_modified = conditional_response(
+        request, response, make_etag("stats", stats), last_modified, CACHE_CONTROL_STATS
+    )
+    if not_modified:
+        return not_modified
+    
+    return SystemStats(**stats)
 
 @router.post("/api/validate/{code_id}")
 async def validate_code(
     code_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    generated_code = db.query(GeneratedCode).filter(GeneratedCode.id == code_id).first()
+    generated_code = await db.get(GeneratedCode, code_id)
     if not generated_code:
         raise HTTPException(status_code=404, detail="Код не найден")
     
-    result = validator.validate(generated_code.generated_code, generated_code.language)
+    result = await validation_executor.validate(generated_code.generated_code, generated_code.language, db=db)
     
-    generated_code.status = "validated" if result["is_valid"] else "error"
-    generated_code.validation_errors = json.dumps(result["errors"]) if result["errors"] else None
-    generated_code.optimization_suggestions = json.dumps(result["suggestions"]) if result["suggestions"] else None
-    
-    db.commit()
+    apply_validation_result(generated_code, result)
+    await db.commit()
     
     return result
 
 # Авторизация
 
 @router.post("/api/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     try:
-        user = auth_service.register_user(db, user_data)
+        hashed_password = await password_hasher.hash_async(user_data.password)
+        user = await run_in_session(db, auth_service.register_user, user_data, hashed_password)
         
         return UserResponse(
             id=user.id,
@@ -222,8 +755,8 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/api/login")
-async def login(user_data: UserLogin, response: Response, db: Session = Depends(get_db)):
-    user = auth_service.authenticate_user(db, user_data.username, user_data.password)
+async def login(user_data: UserLogin, response: Response, db: AsyncSession = Depends(get_async_db)):
+    user = await auth_service.authenticate_user_async(db, user_data.username, user_data.password)
     
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
@@ -278,13 +811,13 @@ async def read_users_me(current_user: User = Depends(get_current_user_dependency
 async def update_user(
     request: UserUpdateRequest,
     current_user: User = Depends(get_current_user_dependency),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if request.email != current_user.email:
-        existing_user = db.query(User).filter(
+        existing_user = await db.scalar(select(User).where(
             User.email == request.email,
             User.id != current_user.id
-        ).first()
+        ))
         
         if existing_user:
             raise HTTPException(
@@ -300,12 +833,15 @@ async def update_user(
     current_user.skills = json.dumps(request.skills)
     
     try:
-        db.commit()
-        db.refresh(current_user)
+        await db.commit()
+        await db.refresh(current_user)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении: {str(e)}")
     
+    # Снимки пользователя в кэше токенов устарели
+    user_token_cache.invalidate_user(current_user.id)
+    
     return {
         "id": current_user.id,
         "username": current_user.username,
@@ -321,20 +857,13 @@ async def update_user(
 # Веб-интерфейс
 
 @router.get("/", response_class=HTMLResponse)
-async def index(request: Request, db: Session = Depends(get_db)):
+async def index(request: Request, db: AsyncSession = Depends(get_async_db)):
     user_context = await get_user_context(request, db)
     
     if user_context["user"]:
-        user_generations = db.query(GeneratedCode).filter(GeneratedCode.user_id == user_context["user"].id).all()
-        stats = {
-            "total_generations": len(user_generations),
-            "total_lines": sum(g.lines_of_code for g in user_generations)
-        }
+        stats = await run_in_session(db, stats_service.get_user_stats, user_context["user"].id)
     else:
-        stats = {
-            "total_generations": db.query(GeneratedCode).count(),
-            "total_lines": db.query(func.sum(GeneratedCode.lines_of_code)).scalar() or 0
-        }
+        stats = await run_in_session(db, stats_service.get_generation_totals)
     
     return templates.TemplateResponse(
         "index.html",
@@ -346,7 +875,7 @@ async def index(request: Request, db: Session = Depends(get_db)):
     )
 
 @router.get("/generator", response_class=HTMLResponse)
-async def generator_page(request: Request, db: Session = Depends(get_db)):
+async def generator_page(request: Request, db: AsyncSession = Depends(get_async_db)):
     user_context = await get_user_context(request, db)
     languages = ["TypeScript", "JavaScript", "Python", "Java", "C#", "Go"]
     frameworks = ["React", "Vue", "Angular", "Express", "Django", "Spring", "FastAPI", ".NET"]
@@ -362,11 +891,16 @@ async def generator_page(request: Request, db: Session = Depends(get_db)):
     )
 
 @router.get("/templates", response_class=HTMLResponse)
-async def templates_page(request: Request, db: Session = Depends(get_db)):
+async def templates_page(request: Request, db: AsyncSession = Depends(get_async_db)):
     user_context = await get_user_context(request, db)
-    templates_list = db.query(Template).filter(Template.is_public == True).all()
-    categories = list(set([t.category for t in templates_list if t.category]))
-    languages = list(set([t.language for t in templates_list]))
+    templates_list = await run_in_session(db, lambda session: template_summary_query(session).all())
+    # Списки для фильтров считаются в базе, без загрузки шаблонов
+    categories = (await db.scalars(select(Template.category).where(
+        Template.is_public == True, Template.category != None
+    ).distinct())).all()
+    languages = (await db.scalars(select(Template.language).where(
+        Template.is_public == True
+    ).distinct())).all()
     
     return templates.TemplateResponse(
         "templates.html",
@@ -382,17 +916,20 @@ async def templates_page(request: Request, db: Session = Depends(get_db)):
     )
 
 @router.get("/projects", response_class=HTMLResponse)
-async def projects_page(request: Request, db: Session = Depends(get_db)):
+async def projects_page(request: Request, db: AsyncSession = Depends(get_async_db)):
     user_context = await get_user_context(request, db)
     
     if not user_context["user"]:
         return RedirectResponse(url="/login")
     
-    generations = db.query(GeneratedCode).filter(
-        GeneratedCode.user_id == user_context["user"].id
-    ).order_by(GeneratedCode.created_at.desc()).all()
+    user_id = user_context["user"].id
+    
+    # Первая страница рендерится сразу, остальные подгружаются из /api/generated-codes при прокрутке
+    generations, next_cursor = await run_in_session(
+        db, load_generation_history_page, user_id, None, DEFAULT_PAGE_SIZE
+    )
     
-    total_generations = len(generations)
+    total_generations = (await run_in_session(db, stats_service.get_user_stats, user_id))["total_generations"]
     
     return templates.TemplateResponse(
         "projects.html",
@@ -400,40 +937,34 @@ async def projects_page(request: Request, db: Session = Depends(get_db)):
             "request": request,
             **user_context,
             "generations": generations,
+            "next_cursor": next_cursor,
             "total_generations": total_generations
         }
     )
 
 @router.get("/profile", response_class=HTMLResponse)
-async def profile_page(request: Request, db: Session = Depends(get_db)):
-    access_token = request.cookies.get("access_token")
-    user = None
-    
-    if access_token:
-        try:
-            payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username:
-                user = db.query(User).filter(User.username == username).first()
-        except:
-            return RedirectResponse(url="/login")
+async def profile_page(request: Request, db: AsyncSession = Depends(get_async_db)):
+    user = await resolve_user(request, db)
     
     if not user:
         return RedirectResponse(url="/login")
     
-    user_generations = db.query(GeneratedCode).filter(
-        GeneratedCode.user_id == user.id
-    ).all()
-    
     user_stats = {
-        "total_generations": len(user_generations),
-        "total_lines": sum(g.lines_of_code for g in user_generations) if user_generations else 0,
+        **await run_in_session(db, stats_service.get_user_stats, user.id),
         "join_date": user.created_at.strftime("%d.%m.%Y")
     }
     
-    recent_generations = db.query(GeneratedCode).filter(
-        GeneratedCode.user_id == user.id
-    ).order_by(GeneratedCode.created_at.desc()).limit(5).all()
+    # Тело сгенерированного кода на странице профиля не нужно
+    recent_generations = (await db.scalars(
+        select(GeneratedCode).options(
+            load_only(
+                GeneratedCode.id, GeneratedCode.requirements, GeneratedCode.language,
+                GeneratedCode.framework, GeneratedCode.lines_of_code, GeneratedCode.created_at
+            )
+        ).where(
+            GeneratedCode.user_id == user.id
+        ).order_by(GeneratedCode.created_at.desc()).limit(5)
+    )).all()
     
     user_skills = json.loads(user.skills) if user.skills else ["JavaScript", "React", "Node.js", "TypeScript", "Python"]
     
@@ -8,6 +8,8 @@ class CodeGenerationRequest(BaseModel):
     framework: str = "react"
     project_id: Optional[int] = None
     template_id: Optional[int] = None
+    use_cache: bool = True
+    as_job: bool = False
 
 class CodeGenerationResponse(BaseModel):
     id: int
@@ -19,16 +21,58 @@ class CodeGenerationResponse(BaseModel):
     status: str
     validation_errors: Optional[str] = None
     optimization_suggestions: Optional[str] = None
+    source: Optional[str] = None
     created_at: datetime
 
-class TemplateResponse(BaseModel):
+class BatchGenerationRequest(BaseModel):
+    items: List[CodeGenerationRequest]
+
+class GenerationJobResponse(BaseModel):
+    job_id: int
+    status: str
+    status_url: str
+
+class GenerationJobStatus(BaseModel):
+    job_id: int
+    status: str
+    language: str
+    framework: Optional[str]
+    lines_of_code: int
+    generated_code: Optional[str] = None
+    validation_errors: Optional[str] = None
+    optimization_suggestions: Optional[str] = None
+    created_at: datetime
+
+class GenerationSummary(BaseModel):
+    id: int
+    requirements: str
+    language: str
+    framework: Optional[str]
+    lines_of_code: int
+    status: str
+    created_at: datetime
+
+class GenerationHistoryPage(BaseModel):
+    items: List[GenerationSummary]
+    next_cursor: Optional[str] = None
+
+class GenerationSearchItem(GenerationSummary):
+    snippet: Optional[str] = None
+
+class GenerationSearchPage(BaseModel):
+    items: List[GenerationSearchItem]
+    total: int
+    facets: Dict[str, Dict[str, int]]
+    next_offset: Optional[int] = None
+
+# Шаблон без кода, для списков
+class TemplateSummary(BaseModel):
     id: int
     name: str
     description: str
     language: str
     category: str
     framework: Optional[str]
-    code: str
     downloads: int
     rating: float
     tags: List[str]
@@ -36,6 +80,12 @@ class TemplateResponse(BaseModel):
     creator_id: Optional[int]
     created_at: datetime
 
+class TemplateResponse(TemplateSummary):
+    code: str
+
+class TemplateSearchResult(TemplateSummary):
+    score: float
+
 class ProjectResponse(BaseModel):
     id: int
     name: str
@@ -0,0 +1,267 @@
+"""
+Полнотекстовый поиск на SQLite FTS5: библиотека шаблонов и история генераций пользователя.
+
+Индексы хранят только токены (external content), а сами тексты остаются в исходных таблицах.
+Синхронизацию при вставке, изменении и удалении строк выполняют триггеры в базе,
+поэтому индекс не расходится с данными, даже если строки меняются в обход ORM.
+"""
+import os
+import re
+from typing import Optional, List, Tuple, Dict, Any
+from sqlalchemy import text, func, or_, Integer, Float, String
+from sqlalchemy.exc import OperationalError
+from database import Template, GeneratedCode
+
+TEMPLATE_SEARCH_RATING_WEIGHT = float(os.getenv("TEMPLATE_SEARCH_RATING_WEIGHT", "0.5"))
+TEMPLATE_SEARCH_DOWNLOADS_WEIGHT = float(os.getenv("TEMPLATE_SEARCH_DOWNLOADS_WEIGHT", "0.5"))
+# Число загрузок, при котором популярность дает половину своего максимального веса
+TEMPLATE_SEARCH_DOWNLOADS_SATURATION = int(os.getenv("TEMPLATE_SEARCH_DOWNLOADS_SATURATION", "100"))
+
+# Веса колонок для bm25 в порядке объявления: name, description, tags, code
+COLUMN_WEIGHTS = (10.0, 4.0, 6.0, 1.0)
+# Для генераций: requirements, generated_code, owner (служебная колонка не влияет на релевантность)
+GENERATION_COLUMN_WEIGHTS = (4.0, 1.0, 0.0)
+
+GENERATION_FACETS = ("language", "framework", "status")
+
+# Текст кода хранится в code_blobs (см. blobs.py), возможно сжатым (см. compression.py)
+CODE_BODY_EXPRESSION = "(SELECT decompress_text(body) FROM code_blobs WHERE hash = {row}.code_hash)"
+
+def build_match_query(query: Optional[str]) -> Optional[str]:
+    # Пользовательский ввод не передаем в MATCH как есть: операторы FTS5 в нем дали бы ошибку синтаксиса.
+    # Каждое слово берем в кавычки, последнее ищем по префиксу, чтобы поиск работал по мере набора.
+    words = re.findall(r'\w+', query or "")
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+# Описание FTS5-индекса над таблицей: колонки индекса задаются SQL-выражениями над строкой таблицы.
+# Если какое-то выражение не просто колонка, индекс читает данные через представление {table}_fts_source.
+class FullTextIndex:
+    def __init__(self, table: str, columns: Tuple[Tuple[str, str], ...], watched: Tuple[str, ...]):
+        self.table = table
+        self.name = f"{table}_fts"
+        self.columns = columns
+        self.watched = watched
+        plain = all(expression == f"{{row}}.{column}" for column, expression in columns)
+        self.source = table if plain else f"{self.name}_source"
+    
+    def _values(self, row: str) -> str:
+        return ', '.join(expression.format(row=row) for _, expression in self.columns)
+    
+    def ddl(self) -> List[str]:
+        names = ', '.join(column for column, _ in self.columns)
+        statements = []
+        if self.source != self.table:
+            select = ', '.join(f"{expression.format(row=self.table)} AS {column}" for column, expression in self.columns)
+            statements.append(f"CREATE VIEW IF NOT EXISTS {self.source} AS SELECT id, {select} FROM {self.table}")
+        statements += [
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {self.name} USING fts5(
+                {names},
+                content='{self.source}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {self.name}_insert AFTER INSERT ON {self.table} BEGIN
+                INSERT INTO {self.name}(rowid, {names}) VALUES (new.id, {self._values('new')});
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {self.name}_delete AFTER DELETE ON {self.table} BEGIN
+                INSERT INTO {self.name}({self.name}, rowid, {names}) VALUES ('delete', old.id, {self._values('old')});
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {self.name}_update AFTER UPDATE OF {', '.join(self.watched)} ON {self.table} BEGIN
+                INSERT INTO {self.name}({self.name}, rowid, {names}) VALUES ('delete', old.id, {self._values('old')});
+                INSERT INTO {self.name}(rowid, {names}) VALUES (new.id, {self._values('new')});
+            END
+            """,
+        ]
+        return statements
+    
+    def drop(self, conn):
+        # Удаляет индекс, триггеры и представление; следующий ensure создаст их заново по текущему описанию
+        for trigger in ("insert", "delete", "update"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {self.name}_{trigger}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {self.name}"))
+        if self.source != self.table:
+            conn.execute(text(f"DROP VIEW IF EXISTS {self.source}"))
+    
+    def ensure(self, engine) -> bool:
+        # Создает индекс и триггеры; False для других СУБД и для SQLite, собранного без FTS5
+        if engine.dialect.name != "sqlite":
+            return False
+        
+        with engine.connect() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": self.name}
+            ).first()
+            
+            try:
+                for statement in self.ddl():
+                    conn.execute(text(statement))
+                if not exists:
+                    # Индексируем строки, созданные до появления индекса
+                    conn.execute(text(f"INSERT INTO {self.name}({self.name}) VALUES ('rebuild')"))
+                conn.commit()
+            except OperationalError as e:
+                conn.rollback()
+                print(f"FTS5 недоступен, индекс {self.name} не создан: {e}")
+                return False
+        
+        if not exists:
+            print(f"Создан полнотекстовый индекс {self.name}")
+        return True
+    
+    def matches(self, match: str, weights: Tuple[float, ...], with_snippet: bool = False):
+        # Подзапрос (id, relevance[, snippet]) для join с исходной таблицей; bm25 отрицателен, меньше - лучше
+        params = {f"w{i}": weight for i, weight in enumerate(weights)}
+        columns = {"id": Integer, "relevance": Float}
+        select = f"rowid AS id, bm25({self.name}, {', '.join(':' + name for name in params)}) AS relevance"
+        if with_snippet:
+            select += f", snippet({self.name}, -1, '', '', '…', 12) AS snippet"
+            columns["snippet"] = String
+        return text(
+            f"SELECT {select} FROM {self.name} WHERE {self.name} MATCH :match"
+        ).bindparams(match=match, **params).columns(**columns).subquery()
+
+class TemplateSearchService:
+    def __init__(self):
+        self.index = FullTextIndex(
+            "templates",
+            (("name", "{row}.name"), ("description", "{row}.description"),
+             ("tags", "{row}.tags"), ("code", CODE_BODY_EXPRESSION)),
+            watched=("name", "description", "tags", "code_hash")
+        )
+        self.available = False
+    
+    def ensure_index(self, engine):
+        self.available = self.index.ensure(engine)
+        if not self.available:
+            print("Поиск шаблонов будет работать через LIKE")
+    
+    def search(self, base_query, query: str, limit: int, offset: int = 0) -> List[Tuple[Any, float]]:
+        # base_query - запрос по Template с уже примененными фильтрами; возвращает пары (шаблон, оценка)
+        match = build_match_query(query)
+        if not match:
+            return []
+        
+        if not self.available:
+            return self._search_like(base_query, query, limit, offset)
+        
+        matches = self.index.matches(match, COLUMN_WEIGHTS)
+        
+        # bm25 берем со знаком минус и усиливаем рейтингом и насыщающейся функцией от числа загрузок
+        downloads = func.coalesce(Template.downloads, 0) * 1.0
+        rating = func.coalesce(Template.rating, 0.0)
+        score = -matches.c.relevance * (
+            1.0
+            + TEMPLATE_SEARCH_RATING_WEIGHT * rating / 5.0
+            + TEMPLATE_SEARCH_DOWNLOADS_WEIGHT * downloads / (downloads + TEMPLATE_SEARCH_DOWNLOADS_SATURATION)
+        )
+        
+        rows = base_query.join(matches, matches.c.id == Template.id).add_columns(score.label("score")).order_by(
+            score.desc(), Template.downloads.desc(), Template.rating.desc(), Template.id.desc()
+        ).offset(offset).limit(limit).all()
+        
+        return [(template, float(score or 0)) for template, score in rows]
+    
+    def _search_like(self, base_query, query: str, limit: int, offset: int) -> List[Tuple[Any, float]]:
+        for word in re.findall(r'\w+', query):
+            pattern = f"%{word}%"
+            base_query = base_query.filter(or_(
+                Template.name.ilike(pattern),
+                Template.description.ilike(pattern),
+                Template.tags.ilike(pattern)
+            ))
+        rows = base_query.order_by(
+            Template.downloads.desc(), Template.rating.desc(), Template.id.desc()
+        ).offset(offset).limit(limit).all()
+        return [(template, 0.0) for template in rows]
+
+# Поиск по истории генераций одного пользователя.
+# В индекс добавлена служебная колонка owner с токеном "u<user_id>": условие owner:u42 в MATCH
+# пересекается с остальными термами прямо в индексе, и чужие генерации не попадают в выборку.
+class GenerationSearchService:
+    def __init__(self):
+        self.index = FullTextIndex(
+            "generated_codes",
+            (("requirements", "{row}.requirements"), ("generated_code", CODE_BODY_EXPRESSION),
+             ("owner", "'u' || {row}.user_id")),
+            watched=("requirements", "code_hash", "user_id")
+        )
+        self.available = False
+    
+    def ensure_index(self, engine):
+        self.available = self.index.ensure(engine)
+        if not self.available:
+            print("Поиск по истории генераций будет работать через LIKE")
+    
+    def search(self, base_query, user_id: int, query: Optional[str], filters: Dict[str, Optional[str]],
+               limit: int, offset: int = 0) -> Dict[str, Any]:
+        # base_query - запрос по GeneratedCode пользователя (например, с load_only для списка).
+        # Возвращает страницу пар (генерация, фрагмент текста), общее число найденных и счетчики фасетов.
+        session = base_query.session
+        match = build_match_query(query)
+        generated_code = GeneratedCode.generated_code
+        if session.get_bind().dialect.name == "sqlite":
+            # Код может храниться сжатым (см. compression.py)
+            generated_code = func.decompress_text(generated_code)
+        matches = None
+        
+        if match and self.available:
+            matches = self.index.matches(
+                f'owner:u{user_id} AND {{requirements generated_code}}: ({match})',
+                GENERATION_COLUMN_WEIGHTS,
+                with_snippet=True
+            )
+        
+        def scoped(q, skip_facet: Optional[str] = None):
+            if matches is not None:
+                q = q.join(matches, matches.c.id == GeneratedCode.id)
+            elif match:
+                for word in re.findall(r'\w+', query):
+                    pattern = f"%{word}%"
+                    q = q.filter(or_(
+                        GeneratedCode.requirements.ilike(pattern),
+                        generated_code.ilike(pattern)
+                    ))
+            for facet, value in filters.items():
+                if value and facet != skip_facet:
+                    q = q.filter(getattr(GeneratedCode, facet) == value)
+            return q
+        
+        if matches is not None:
+            items_query = scoped(base_query).add_columns(matches.c.snippet).order_by(
+                matches.c.relevance, GeneratedCode.created_at.desc(), GeneratedCode.id.desc()
+            )
+            items = items_query.offset(offset).limit(limit).all()
+        else:
+            items_query = scoped(base_query).order_by(GeneratedCode.created_at.desc(), GeneratedCode.id.desc())
+            items = [(generation, None) for generation in items_query.offset(offset).limit(limit).all()]
+        
+        total = scoped(
+            session.query(func.count(GeneratedCode.id)).filter(GeneratedCode.user_id == user_id)
+        ).scalar()
+        
+        # Счетчики каждого фасета считаются без его собственного фильтра,
+        # чтобы в интерфейсе было видно, сколько результатов даст другое значение
+        facets = {}
+        for facet in GENERATION_FACETS:
+            column = getattr(GeneratedCode, facet)
+            rows = scoped(
+                session.query(column, func.count(GeneratedCode.id)).filter(GeneratedCode.user_id == user_id),
+                skip_facet=facet
+            ).group_by(column).order_by(func.count(GeneratedCode.id).desc()).all()
+            facets[facet] = {value: count for value, count in rows if value}
+        
+        return {"items": items, "total": total, "facets": facets}
+
+template_search = TemplateSearchService()
+generation_search = GenerationSearchService()
@@ -1,28 +1,52 @@
 import os
 import re
 import json
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import jwt
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
-from database import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, User
+from database import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, User, GenerationCache, ValidationCache
+from database import run_in_session
+from passwords import password_hasher
 from schemas import UserCreate, UserLogin
+from analyzers import create_analyzer, iter_lines
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = None
+OPENAI_MODEL = "gpt-5-nano"
+# Максимальное число одновременных генераций на одном воркере
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "16"))
+# Как часто потоковая генерация сохраняет промежуточный код в БД
+STREAM_CHECKPOINT_SECONDS = float(os.getenv("STREAM_CHECKPOINT_SECONDS", "2.0"))
+STREAM_CHECKPOINT_CHARS = int(os.getenv("STREAM_CHECKPOINT_CHARS", "4000"))
+# Пакетная генерация: максимум элементов в запросе и одновременных генераций на один пакет
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Валидация выполняется в отдельных процессах с ограничением по времени
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", str(os.cpu_count() or 2)))
+VALIDATION_TIMEOUT_SECONDS = float(os.getenv("VALIDATION_TIMEOUT_SECONDS", "10"))
+# Кэш результатов валидации: максимальное число записей
+VALIDATION_CACHE_MAX_ENTRIES = int(os.getenv("VALIDATION_CACHE_MAX_ENTRIES", "5000"))
+# Кэш результатов генерации: время жизни записи и максимальное число записей
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "1000"))
+async_openai_client = None
 OPENAI_AVAILABLE = False
 
 try:
     if OPENAI_API_KEY:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+        async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
         OPENAI_AVAILABLE = True
         print("OpenAI API подключен")
     else:
@@ -30,17 +54,113 @@ try:
 except Exception as e:
     print(f"Не удалось подключить OpenAI API: {e}")
 
+# Кэш результатов генерации (TTL + вытеснение давно неиспользуемых записей)
+class GenerationCacheService:
+    def __init__(self, ttl_seconds: int = GENERATION_CACHE_TTL_SECONDS, max_entries: int = GENERATION_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+    
+    @staticmethod
+    def make_key(requirements: str, language: str, framework: str) -> str:
+        normalized = "\n".join([
+            OPENAI_MODEL,
+            " ".join(requirements.split()).casefold(),
+            language.strip().casefold(),
+            (framework or "").strip().casefold()
+        ])
+        return hashlib.sha256(normalized.encode()).hexdigest()
+    
+    def get(self, db: Session, requirements: str, language: str, framework: str) -> Optional[Dict[str, Any]]:
+        try:
+            key = self.make_key(requirements, language, framework)
+            entry = db.query(GenerationCache).filter(GenerationCache.cache_key == key).first()
+            if not entry:
+                return None
+            
+            now = datetime.now()
+            if entry.created_at < now - timedelta(seconds=self.ttl_seconds):
+                db.delete(entry)
+                db.commit()
+                return None
+            
+            entry.hits += 1
+            entry.last_used_at = now
+            db.commit()
+            
+            return {
+                "generated_code": entry.generated_code,
+                "language": language,
+                "framework": framework,
+                "lines_of_code": entry.lines_of_code,
+                "status": "generated",
+                "source": "cache"
+            }
+        except Exception as e:
+            db.rollback()
+            print(f"Ошибка при чтении кэша генерации: {e}")
+            return None
+    
+    def put(self, db: Session, requirements: str, language: str, framework: str, result: Dict[str, Any]):
+        try:
+            key = self.make_key(requirements, language, framework)
+            now = datetime.now()
+            entry = db.query(GenerationCache).filter(GenerationCache.cache_key == key).first()
+            if not entry:
+                entry = GenerationCache(cache_key=key, hits=0)
+                db.add(entry)
+            
+            entry.generated_code = result["generated_code"]
+            entry.language = language
+            entry.framework = framework
+            entry.lines_of_code = result["lines_of_code"]
+            entry.created_at = now
+            entry.last_used_at = now
+            
+            try:
+                db.commit()
+            except IntegrityError:
+                # Ту же запись успел сохранить параллельный запрос
+                db.rollback()
+                return
+            
+            self.evict(db)
+        except Exception as e:
+            db.rollback()
+            print(f"Ошибка при записи в кэш генерации: {e}")
+    
+    def evict(self, db: Session):
+        expired_before = datetime.now() - timedelta(seconds=self.ttl_seconds)
+        db.query(GenerationCache).filter(
+            GenerationCache.created_at < expired_before
+        ).delete(synchronize_session=False)
+        
+        evict_least_recently_used(db, GenerationCache, self.max_entries)
+        db.commit()
+
+def evict_least_recently_used(db: Session, model, max_entries: int):
+    # Удаляет самые давно использованные записи кэш-таблицы сверх max_entries (без коммита)
+    overflow = (db.query(func.count(model.id)).scalar() or 0) - max_entries
+    if overflow > 0:
+        stale_ids = [
+            row.id for row in db.query(model.id)
+            .order_by(model.last_used_at)
+            .limit(overflow)
+        ]
+        db.query(model).filter(
+            model.id.in_(stale_ids)
+        ).delete(synchronize_session=False)
+
 # Сервис генерации кода
 class CodeGeneratorService:
     def __init__(self):
-        self.openai_client = openai_client if OPENAI_AVAILABLE else None
+        self.async_openai_client = async_openai_client if OPENAI_AVAILABLE else None
+        self.max_concurrency = GENERATION_MAX_CONCURRENCY
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
     
-    def generate_code_with_openai(self, requirements: str, language: str, framework: str) -> Optional[Dict[str, Any]]:
-        if not self.openai_client:
-            return None
-        
-        try:
-            prompt = f"""Ты - эксперт по программированию. Сгенерируй качественный, рабочий код на языке {language} с использованием фреймворка {framework}.
+    def build_prompt(self, requirements: str, language: str, framework: str) -> str:
+        return f"""Ты - эксперт по программированию. Сгенерируй качественный, рабочий код на языке {language} с использованием фреймворка {framework}.
 
 ТРЕБОВАНИЯ ПОЛЬЗОВАТЕЛЯ:
 {requirements}
@@ -56,30 +176,40 @@ class CodeGeneratorService:
 8. Используй современные подходы и паттерны
 
 ВАЖНО: Выведи только чистый код, без пояснений, без ``` в начале и конце."""
+    
+    def build_openai_result(self, output_text: str, language: str, framework: str) -> Dict[str, Any]:
+        code = output_text.strip()
+        code = re.sub(r'^```[\w]*\n', '', code)
+        code = re.sub(r'\n```$', '', code)
+        
+        lines_of_code = len(code.split('\n'))
+        
+        return {
+            "generated_code": code,
+            "language": language,
+            "framework": framework,
+            "lines_of_code": lines_of_code,
+            "status": "generated",
+            "source": "openai_api"
+        }
+    
+    async def generate_code_with_openai_async(self, requirements: str, language: str, framework: str) -> Optional[Dict[str, Any]]:
+        if not self.async_openai_client:
+            return None
+        
+        try:
+            prompt = self.build_prompt(requirements, language, framework)
             
-            print(f"Отправляем запрос к OpenAI API: {language}/{framework}")
+            print(f"Отправляем асинхронный запрос к OpenAI API: {language}/{framework}")
             
-            response = self.openai_client.responses.create(
-                model="gpt-5-nano",
+            response = await self.async_openai_client.responses.create(
+                model=OPENAI_MODEL,
                 input=prompt,
                 store=True,
             )
             
             if response and response.output_text:
-                code = response.output_text.strip()
-                code = re.sub(r'^```[\w]*\n', '', code)
-                code = re.sub(r'\n```$', '', code)
-                
-                lines_of_code = len(code.split('\n'))
-                
-                return {
-                    "generated_code": code,
-                    "language": language,
-                    "framework": framework,
-                    "lines_of_code": lines_of_code,
-                    "status": "generated",
-                    "source": "openai_api"
-                }
+                return self.build_openai_result(response.output_text, language, framework)
             
         except Exception as e:
             print(f"Ошибка при генерации через OpenAI: {e}")
@@ -111,61 +241,364 @@ class CodeGeneratorService:
             "source": "simple_templates"
         }
     
-    def generate_code(self, requirements: str, language: str = "typescript", framework: str = "react") -> Dict[str, Any]:
-        if self.openai_client:
-            print(f"Пытаюсь использовать OpenAI API для генерации кода...")
-            openai_result = self.generate_code_with_openai(requirements, language, framework)
-            
-            if openai_result:
-                print(f"Код сгенерирован через OpenAI API ({language}/{framework})")
-                return openai_result
-            else:
-                print(f"OpenAI вернул ошибку, использую простые шаблоны")
+    async def generate_code_async(self, requirements: str, language: str = "typescript", framework: str = "react",
+                                  db=None, use_cache: bool = True) -> Dict[str, Any]:
+        # Не блокирует event loop: запрос к OpenAI идет через асинхронный клиент,
+        # а число одновременных генераций ограничено семафором. db - Session или AsyncSession
+        if db is not None and use_cache:
+            cached_result = await run_in_session(db, generation_cache.get, requirements, language, framework)
+            if cached_result:
+                print(f"Код взят из кэша ({language}/{framework})")
+                return cached_result
+        
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            self.in_flight += 1
+            try:
+                if self.async_openai_client:
+                    openai_result = await self.generate_code_with_openai_async(requirements, language, framework)
+                    
+                    if openai_result:
+                        print(f"Код сгенерирован через OpenAI API ({language}/{framework})")
+                        if db is not None:
+                            await run_in_session(db, generation_cache.put, requirements, language, framework, openai_result)
+                        return openai_result
+                    print(f"OpenAI вернул ошибку, использую простые шаблоны")
+                else:
+                    print(f"OpenAI недоступен, использую простые шаблоны")
                 return self.generate_simple_code(requirements, language, framework)
-        else:
-            print(f"OpenAI недоступен, использую простые шаблоны")
-            return self.generate_simple_code(requirements, language, framework)
+            finally:
+                self.in_flight -= 1
+    
+    async def generate_batch_async(self, items: List[Dict[str, Any]], db=None,
+                                   max_concurrency: int = BATCH_MAX_CONCURRENCY) -> List[Dict[str, Any]]:
+        # Генерирует все элементы пакета параллельно, не более max_concurrency одновременно.
+        # Одинаковые запросы внутри пакета генерируются один раз.
+        batch_semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def generate_item(item: Dict[str, Any]) -> Dict[str, Any]:
+            async with batch_semaphore:
+                return await self.generate_code_async(
+                    item["requirements"],
+                    item["language"],
+                    item["framework"],
+                    db=db,
+                    use_cache=item.get("use_cache", True)
+                )
+        
+        unique_items: Dict[str, Dict[str, Any]] = {}
+        item_keys = []
+        for index, item in enumerate(items):
+            if item.get("use_cache", True):
+                key = generation_cache.make_key(item["requirements"], item["language"], item["framework"])
+            else:
+                key = f"uncached:{index}"
+            unique_items.setdefault(key, item)
+            item_keys.append(key)
+        
+        unique_results = await asyncio.gather(*(generate_item(item) for item in unique_items.values()))
+        results_by_key = dict(zip(unique_items.keys(), unique_results))
+        return [results_by_key[key] for key in item_keys]
+    
+    async def stream_code_async(self, requirements: str, language: str = "typescript", framework: str = "react",
+                                db=None, use_cache: bool = True) -> AsyncIterator[Tuple[str, str]]:
+        # Отдает пары (источник, фрагмент кода) по мере их получения от OpenAI.
+        # Код из кэша приходит одним фрагментом; полный ответ OpenAI сохраняется в кэш, как в generate_code_async
+        if db is not None and use_cache:
+            cached_result = await run_in_session(db, generation_cache.get, requirements, language, framework)
+            if cached_result:
+                print(f"Код взят из кэша ({language}/{framework})")
+                yield "cache", cached_result["generated_code"]
+                return
+        
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            self.in_flight += 1
+            try:
+                if not self.async_openai_client:
+                    print(f"OpenAI недоступен, использую простые шаблоны")
+                    yield "simple_templates", self.generate_simple_code(requirements, language, framework)["generated_code"]
+                    return
+                
+                prompt = self.build_prompt(requirements, language, framework)
+                print(f"Отправляем потоковый запрос к OpenAI API: {language}/{framework}")
+                
+                received: List[str] = []
+                try:
+                    stream = await self.async_openai_client.responses.create(
+                        model=OPENAI_MODEL,
+                        input=prompt,
+                        store=True,
+                        stream=True,
+                    )
+                    async for event in stream:
+                        if event.type == "response.output_text.delta" and event.delta:
+                            received.append(event.delta)
+                            yield "openai_api", event.delta
+                except Exception as e:
+                    print(f"Ошибка при потоковой генерации через OpenAI: {e}")
+                    if received:
+                        raise
+                
+                if not received:
+                    print(f"OpenAI вернул ошибку, использую простые шаблоны")
+                    yield "simple_templates", self.generate_simple_code(requirements, language, framework)["generated_code"]
+                elif db is not None:
+                    openai_result = self.build_openai_result("".join(received), language, framework)
+                    await run_in_session(db, generation_cache.put, requirements, language, framework, openai_result)
+            finally:
+                self.in_flight -= 1
+    
+    def get_load(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency
+        }
+
+# Буфер потоковой генерации: убирает ``` и считает строки по мере поступления текста
+class StreamingCodeBuffer:
+    FENCE = "```"
+    
+    def __init__(self):
+        self.parts: List[str] = []
+        self.newlines = 0
+        self.pending = ""
+        self.started = False
+    
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+    
+    @property
+    def lines_of_code(self) -> int:
+        return self.newlines + 1
+    
+    def _emit(self, text: str) -> str:
+        if text:
+            self.parts.append(text)
+            self.newlines += text.count("\n")
+        return text
+    
+    def feed(self, chunk: str) -> str:
+        self.pending += chunk
+        
+        if not self.started:
+            # Пропускаем ведущие пробелы и открывающий ```lang
+            self.pending = self.pending.lstrip()
+            if not self.pending:
+                return ""
+            if len(self.pending) < 3 and self.FENCE.startswith(self.pending):
+                return ""
+            if self.pending.startswith(self.FENCE):
+                match = re.match(r'^```[\w]*\n', self.pending)
+                if match:
+                    self.pending = self.pending[match.end():]
+                elif re.fullmatch(r'```[\w]*', self.pending):
+                    return ""
+            self.started = True
+        
+        # Придерживаем хвост, который может оказаться закрывающим ``` или пробелами в конце
+        cut = re.search(r'(\n`{0,3})?\s*$', self.pending).start()
+        text, self.pending = self.pending[:cut], self.pending[cut:]
+        return self._emit(text)
+    
+    def finish(self) -> str:
+        tail = self.pending.rstrip()
+        self.pending = ""
+        if tail == "\n" + self.FENCE:
+            tail = ""
+        return self._emit(tail)
 
-# Валидатор кода
+# Валидатор кода: один проход по строкам, языковые проверки выполняют анализаторы из analyzers.py
 class CodeValidator:
+    # Увеличивайте при изменении правил: закэшированные результаты старой версии перестанут использоваться
+    VERSION = 2
+    MAX_LINE_LENGTH = 100
+    # Повторы коротких строк вроде "}" или "});" дублированием не считаются
+    MIN_DUPLICATE_LINE_LENGTH = 4
+    
     @staticmethod
     def validate(code: str, language: str) -> Dict[str, Any]:
-        errors = []
-        warnings = []
-        suggestions = []
+        analyzer = create_analyzer(language, code)
         
         if not code or len(code.strip()) < 10:
-            errors.append("Код слишком короткий или пустой")
+            analyzer.report("error", "Код слишком короткий или пустой", rule="too-short")
         
-        if language.lower() == "python":
-            try:
-                compile(code, '<string>', 'exec')
-            except SyntaxError as e:
-                errors.append(f"Синтаксическая ошибка Python: {e}")
+        line_count = 0
+        seen_lines = set()
+        duplicate_lines = 0
         
-        lines = code.split('\n')
+        for line_count, line in enumerate(iter_lines(code), 1):
+            if len(line) > CodeValidator.MAX_LINE_LENGTH:
+                analyzer.report("warning", f"Строка {line_count} превышает {CodeValidator.MAX_LINE_LENGTH} символов",
+                                line_count, "line-length")
+            
+            analyzer.feed_line(line_count, line)
+            
+            stripped = line.strip()
+            if len(stripped) >= CodeValidator.MIN_DUPLICATE_LINE_LENGTH:
+                line_hash = hash(stripped)
+                if line_hash in seen_lines:
+                    duplicate_lines += 1
+                else:
+                    seen_lines.add(line_hash)
         
-        for i, line in enumerate(lines, 1):
-            if len(line) > 100:
-                warnings.append(f"Строка {i} превышает 100 символов")
+        analyzer.finish(line_count)
         
-        comment_count = sum(1 for line in lines if line.strip().startswith('#')) if language == "python" else \
-                       sum(1 for line in lines if '//' in line or '/*' in line)
+        if analyzer.comment_lines < 3 and line_count > 20:
+            analyzer.report("suggestion", "Добавьте комментарии для лучшей читаемости кода", rule="comments")
         
-        if comment_count < 3 and len(lines) > 20:
-            suggestions.append("Добавьте комментарии для лучшей читаемости кода")
+        if duplicate_lines > 5:
+            analyzer.report("warning", "Обнаружено дублирование кода", rule="duplication")
         
-        unique_lines = set(lines)
-        if len(lines) - len(unique_lines) > 5:
-            warnings.append("Обнаружено дублирование кода")
+        issues = analyzer.issues
+        errors = [issue["message"] for issue in issues if issue["severity"] == "error"]
         
         return {
             "is_valid": len(errors) == 0,
             "errors": errors,
-            "warnings": warnings,
-            "suggestions": suggestions
+            "warnings": [issue["message"] for issue in issues if issue["severity"] == "warning"],
+            "suggestions": [issue["message"] for issue in issues if issue["severity"] == "suggestion"],
+            "issues": issues
         }
 
+# Кэш результатов валидации по содержимому кода
+class ValidationCacheService:
+    def __init__(self, max_entries: int = VALIDATION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+    
+    @staticmethod
+    def make_key(code: str, language: str, version: int = CodeValidator.VERSION) -> str:
+        code_hash = hashlib.sha256(code.encode()).hexdigest()
+        return hashlib.sha256(f"{code_hash}:{(language or '').strip().lower()}:{version}".encode()).hexdigest()
+    
+    def get(self, db: Session, code: str, language: str) -> Optional[Dict[str, Any]]:
+        try:
+            key = self.make_key(code, language)
+            entry = db.query(ValidationCache).filter(ValidationCache.cache_key == key).first()
+            if not entry:
+                return None
+            
+            entry.hits += 1
+            entry.last_used_at = datetime.now()
+            db.commit()
+            return json.loads(entry.result)
+        except Exception as e:
+            db.rollback()
+            print(f"Ошибка при чтении кэша валидации: {e}")
+            return None
+    
+    def put(self, db: Session, code: str, language: str, result: Dict[str, Any]):
+        try:
+            db.add(ValidationCache(
+                cache_key=self.make_key(code, language),
+                validator_version=CodeValidator.VERSION,
+                result=json.dumps(result, ensure_ascii=False),
+                hits=0
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Тот же код уже провалидирован параллельно
+                db.rollback()
+                return
+            
+            self.evict(db)
+        except Exception as e:
+            db.rollback()
+            print(f"Ошибка при записи в кэш валидации: {e}")
+    
+    def evict(self, db: Session):
+        db.query(ValidationCache).filter(
+            ValidationCache.validator_version != CodeValidator.VERSION
+        ).delete(synchronize_session=False)
+        
+        evict_least_recently_used(db, ValidationCache, self.max_entries)
+        db.commit()
+
+def run_validation_job(code: str, language: str) -> Dict[str, Any]:
+    # Точка входа для процессов пула валидации
+    return CodeValidator.validate(code, language)
+
+# Пул процессов для валидации: тяжелые проверки не занимают процессор обслуживающего воркера
+class ValidationExecutor:
+    def __init__(self, workers: int = VALIDATION_WORKERS, timeout: float = VALIDATION_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # В пул уходит не больше задач, чем в нем процессов: задача начинается сразу после отправки,
+        # поэтому таймаут считает время проверки, а не ожидание в очереди пула
+        self._slots = asyncio.Semaphore(workers)
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+    
+    def _recycle(self, pool: ProcessPoolExecutor, terminate: bool = False):
+        # Новые задачи уходят в новый пул. После таймаута процессы старого пула завершаются:
+        # иначе зависшая проверка продолжала бы занимать ядро рядом с новым пулом.
+        # Публичного способа остановить процессы у ProcessPoolExecutor нет, поэтому используем _processes.
+        if self._pool is pool:
+            self._pool = None
+        if terminate:
+            for process in list((pool._processes or {}).values()):
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    async def _run(self, code: str, language: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            while True:
+                pool = self._get_pool()
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(pool, run_validation_job, code, language),
+                        timeout=self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    self._recycle(pool, terminate=True)
+                    raise
+                except BrokenProcessPool:
+                    if self._pool is not pool:
+                        # Пул остановлен из-за таймаута соседней задачи - повторяем проверку в новом
+                        continue
+                    self._recycle(pool)
+                    raise
+    
+    async def validate(self, code: str, language: str, db=None) -> Dict[str, Any]:
+        # db - Session или AsyncSession для кэша результатов
+        if db is not None:
+            cached_result = await run_in_session(db, validation_cache.get, code, language)
+            if cached_result:
+                return cached_result
+        
+        try:
+            result = await self._run(code, language)
+        except asyncio.TimeoutError:
+            print(f"Валидация не уложилась в {self.timeout} с")
+            message = f"Превышено время валидации ({self.timeout:g} с)"
+            return {
+                "is_valid": False,
+                "errors": [message],
+                "warnings": [],
+                "suggestions": [],
+                "issues": [{"severity": "error", "line": None, "rule": "timeout", "message": message}]
+            }
+        
+        # Таймауты не кэшируются: при следующей попытке код может успеть провериться
+        if db is not None:
+            await run_in_session(db, validation_cache.put, code, language, result)
+        return result
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
 # Сервис аутентификации
 class AuthService:
     @staticmethod
@@ -181,7 +614,8 @@ class AuthService:
         return encoded_jwt
     
     @staticmethod
-    def register_user(db: Session, user_data: UserCreate):
+    def register_user(db: Session, user_data: UserCreate, hashed_password: Optional[str] = None):
+        # hashed_password - хеш, заранее посчитанный через password_hasher.hash_async
         existing_user = db.query(User).filter(
             (User.username == user_data.username) | (User.email == user_data.email)
         ).first()
@@ -197,7 +631,10 @@ class AuthService:
             skills=json.dumps(["JavaScript", "React", "Node.js", "TypeScript"])
         )
         
-        user.set_password(user_data.password)
+        if hashed_password:
+            user.hashed_password = hashed_password
+        else:
+            user.set_password(user_data.password)
         
         db.add(user)
         db.commit()
@@ -206,13 +643,24 @@ class AuthService:
         return user
     
     @staticmethod
-    def authenticate_user(db: Session, username: str, password: str):
-        user = db.query(User).filter(User.username == username).first()
-        if not user or not user.check_password(password):
+    async def authenticate_user_async(db, username: str, password: str):
+        # Проверка и пересчет хеша идут в пуле password_hasher, запросы к базе - через run_in_session
+        user = await run_in_session(db, lambda session: session.query(User).filter(User.username == username).first())
+        if not user:
+            await password_hasher.verify_dummy_async(password)
+            return None
+        if not await password_hasher.verify_async(password, user.hashed_password):
             return None
+        if password_hasher.needs_rehash(user.hashed_password):
+            # Старый формат или устаревшие параметры: пароль известен только сейчас, пересчитываем хеш
+            user.hashed_password = await password_hasher.hash_async(password)
+            await run_in_session(db, lambda session: session.commit())
         return user
 
 # Инициализация сервисов
+generation_cache = GenerationCacheService()
 code_generator = CodeGeneratorService()
 validator = CodeValidator()
+validation_cache = ValidationCacheService()
+validation_executor = ValidationExecutor()
 auth_service = AuthService()
\ No newline at end of file
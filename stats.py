@@ -0,0 +1,219 @@
+"""
+Материализованная статистика системы.
+
+Счетчики хранятся в одной строке таблицы system_counters и обновляются в той же транзакции,
+что и изменения проектов, шаблонов и пользователей (событие after_flush сессии).
+/api/stats читает одну строку вместо нескольких COUNT/SUM по всем таблицам.
+Счетчики генераций пользователя (user_stats) создаются при первом чтении одним агрегирующим
+запросом и дальше поддерживаются тем же обработчиком.
+Массовые query.update()/delete() мимо ORM счетчики не обновляют, поэтому при старте
+приложения счетчики пересчитываются одним агрегирующим запросом (rebuild).
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any
+from sqlalchemy import event, select, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, attributes
+from database import SystemCounters, UserStats, Project, Template, User, GeneratedCode
+
+COUNTERS_ROW_ID = 1
+
+# Вклад строки каждой модели в счетчики: (отслеживаемые поля, функция от их значений).
+# Ключ-строка - столбец system_counters, ключ (столбец, user_id) - столбец user_stats пользователя.
+TRACKED_MODELS = {
+    Project: (
+        ("status", "lines_of_code"),
+        lambda status, lines_of_code: {
+            "total_projects": 1,
+            "total_lines_of_code": lines_of_code or 0,
+            "completed_projects": 1 if status == "completed" else 0,
+            "active_projects": 1 if status == "in_progress" else 0,
+        }
+    ),
+    Template: (
+        ("is_public",),
+        lambda is_public: {"total_templates": 1 if is_public else 0}
+    ),
+    User: (
+        (),
+        lambda: {"total_users": 1}
+    ),
+    GeneratedCode: (
+        ("user_id", "lines_of_code"),
+        lambda user_id, lines_of_code: {
+            "total_generations": 1,
+            "total_generated_lines": lines_of_code or 0,
+            ("total_generations", user_id): 1,
+            ("total_lines", user_id): lines_of_code or 0,
+        }
+    ),
+}
+
+def _track_previous_value(target, value, oldvalue, initiator):
+    pass
+
+# active_history: при изменении поля у объекта с истекшим состоянием (после commit) SQLAlchemy
+# сначала загрузит старое значение, иначе вычесть прежний вклад строки будет не из чего
+for _model, (_fields, _) in TRACKED_MODELS.items():
+    for _field in _fields:
+        event.listen(getattr(_model, _field), "set", _track_previous_value, active_history=True)
+
+def _add(deltas: Dict[str, int], contribution: Dict[str, int], sign: int):
+    for counter, value in contribution.items():
+        deltas[counter] += sign * value
+
+def _previous_values(obj, fields):
+    values = []
+    for field in fields:
+        history = attributes.get_history(obj, field)
+        if history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(obj, field))
+    return values
+
+# Слушаем класс Session: так обработчик срабатывает и для SessionLocal,
+# и для синхронных сессий внутри AsyncSession
+@event.listens_for(Session, "after_flush")
+def update_counters_after_flush(session: Session, flush_context):
+    deltas: Dict[str, int] = defaultdict(int)
+    
+    for obj in session.new:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked:
+            fields, contribution = tracked
+            _add(deltas, contribution(*(getattr(obj, field) for field in fields)), 1)
+    
+    for obj in session.dirty:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked and tracked[0] and session.is_modified(obj):
+            fields, contribution = tracked
+            _add(deltas, contribution(*_previous_values(obj, fields)), -1)
+            _add(deltas, contribution(*(getattr(obj, field) for field in fields)), 1)
+    
+    for obj in session.deleted:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked:
+            fields, contribution = tracked
+            _add(deltas, contribution(*_previous_values(obj, fields)), -1)
+    
+    changes = {}
+    user_changes: Dict[int, Dict[str, int]] = defaultdict(dict)
+    for counter, delta in deltas.items():
+        if not delta:
+            continue
+        if isinstance(counter, tuple):
+            column, user_id = counter
+            if user_id is not None:
+                user_changes[user_id][column] = delta
+        else:
+            changes[counter] = delta
+    
+    connection = session.connection()
+    if changes:
+        table = SystemCounters.__table__
+        connection.execute(
+            update(table)
+            .where(table.c.id == COUNTERS_ROW_ID)
+            .values({counter: table.c[counter] + delta for counter, delta in changes.items()})
+        )
+    
+    # Строки user_stats, которых еще нет, будут посчитаны целиком при первом чтении
+    user_table = UserStats.__table__
+    for user_id, columns in user_changes.items():
+        connection.execute(
+            update(user_table)
+            .where(user_table.c.user_id == user_id)
+            .values({column: user_table.c[column] + delta for column, delta in columns.items()})
+        )
+
+class StatsService:
+    @staticmethod
+    def rebuild(db: Session) -> SystemCounters:
+        # Один запрос со скалярными подзапросами вместо шести отдельных
+        row = db.execute(select(
+            select(func.count(Project.id)).scalar_subquery(),
+            select(func.count(Project.id)).where(Project.status == "completed").scalar_subquery(),
+            select(func.count(Project.id)).where(Project.status == "in_progress").scalar_subquery(),
+            select(func.coalesce(func.sum(Project.lines_of_code), 0)).scalar_subquery(),
+            select(func.count(Template.id)).where(Template.is_public == True).scalar_subquery(),
+            select(func.count(User.id)).scalar_subquery(),
+            select(func.count(GeneratedCode.id)).scalar_subquery(),
+            select(func.coalesce(func.sum(GeneratedCode.lines_of_code), 0)).scalar_subquery(),
+        )).one()
+        
+        counters = db.get(SystemCounters, COUNTERS_ROW_ID)
+        if counters is None:
+            counters = SystemCounters(id=COUNTERS_ROW_ID)
+            db.add(counters)
+        
+        (counters.total_projects, counters.completed_projects, counters.active_projects,
+         counters.total_lines_of_code, counters.total_templates, counters.total_users,
+         counters.total_generations, counters.total_generated_lines) = row
+        counters.rebuilt_at = datetime.now()
+        
+        # Счетчики пользователей пересчитаются лениво при следующем чтении
+        db.query(UserStats).delete(synchronize_session=False)
+        db.commit()
+        return counters
+    
+    @staticmethod
+    def _counters(db: Session) -> SystemCounters:
+        counters = db.get(SystemCounters, COUNTERS_ROW_ID)
+        if counters is None:
+            counters = StatsService.rebuild(db)
+        return counters
+    
+    @staticmethod
+    def get(db: Session) -> Dict[str, Any]:
+        counters = StatsService._counters(db)
+        
+        return {
+            "total_projects": counters.total_projects,
+            "completed_projects": counters.completed_projects,
+            "total_lines_of_code": counters.total_lines_of_code,
+            "active_projects": counters.active_projects,
+            "total_templates": counters.total_templates,
+            "total_users": counters.total_users
+        }
+
+    @staticmethod
+    def last_modified(db: Session) -> datetime:
+        # Время последнего изменения счетчиков - Last-Modified для /api/stats
+        counters = StatsService._counters(db)
+        return counters.updated_at or counters.rebuilt_at
+    
+    @staticmethod
+    def get_generation_totals(db: Session) -> Dict[str, int]:
+        counters = StatsService._counters(db)
+        return {
+            "total_generations": counters.total_generations,
+            "total_lines": counters.total_generated_lines
+        }
+    
+    @staticmethod
+    def get_user_stats(db: Session, user_id: int) -> Dict[str, int]:
+        user_stats = db.get(UserStats, user_id)
+        
+        if user_stats is None:
+            total_generations, total_lines = db.query(
+                func.count(GeneratedCode.id),
+                func.coalesce(func.sum(GeneratedCode.lines_of_code), 0)
+            ).filter(GeneratedCode.user_id == user_id).one()
+            
+            user_stats = UserStats(user_id=user_id, total_generations=total_generations, total_lines=total_lines)
+            db.add(user_stats)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Строку успел создать параллельный запрос
+                db.rollback()
+                user_stats = db.get(UserStats, user_id)
+        
+        return {
+            "total_generations": user_stats.total_generations,
+            "total_lines": user_stats.total_lines
+        }
+
+stats_service = StatsService()
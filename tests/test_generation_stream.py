@@ -0,0 +1,76 @@
+"""
+Потоковая генерация: отключение клиента посреди потока.
+
+Приложение вызывается напрямую как ASGI: после нескольких фрагментов кода receive отдает
+http.disconnect, и Starlette отменяет ответ так же, как при обрыве соединения под uvicorn.
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_DIR}/codegen.db"
+os.environ["OPENAI_API_KEY"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+import main
+import routes
+import database
+
+TOKENS_BEFORE_DISCONNECT = 20
+
+async def slow_stream(*args, **kwargs):
+    for i in range(1000):
+        yield "openai_api", f"line {i}\n"
+        await asyncio.sleep(0.005)
+
+def login_cookie() -> str:
+    client = TestClient(main.app)
+    client.post("/api/register", json={"username": "stream", "email": "stream@example.com", "password": "secret123"})
+    response = client.post("/api/login", json={"username": "stream", "password": "secret123"})
+    assert response.status_code == 200
+    return f"access_token={response.cookies['access_token']}"
+
+async def stream_and_disconnect(cookie: str) -> int:
+    payload = json.dumps({"requirements": "r", "language": "Python", "framework": "none"}).encode()
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/api/generate/stream", "raw_path": b"/api/generate/stream", "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    disconnected = asyncio.Event()
+    state = {"body_sent": False, "tokens": 0}
+    
+    async def receive():
+        if not state["body_sent"]:
+            state["body_sent"] = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        if message["type"] == "http.response.body" and b"event: token" in message.get("body", b""):
+            state["tokens"] += 1
+            if state["tokens"] >= TOKENS_BEFORE_DISCONNECT:
+                disconnected.set()
+    
+    await main.app(scope, receive, send)
+    return state["tokens"]
+
+def test_disconnect_saves_partial_generation(monkeypatch):
+    monkeypatch.setattr(routes.code_generator, "stream_code_async", slow_stream)
+    cookie = login_cookie()
+    
+    tokens = asyncio.run(stream_and_disconnect(cookie))
+    assert TOKENS_BEFORE_DISCONNECT <= tokens < 1000
+    
+    with database.SessionLocal() as db:
+        generation = db.query(database.GeneratedCode).order_by(database.GeneratedCode.id.desc()).first()
+        assert generation.status == "error"
+        assert json.loads(generation.validation_errors) == ["Генерация прервана: клиент отключился"]
+        assert generation.generated_code.startswith("line 0\n")
+        assert generation.lines_of_code > 1